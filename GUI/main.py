@@ -1,9 +1,181 @@
+import io
+import os
 import sys
-import sqlite3
 import csv
+import string
+import threading
+from PyQt5.QtCore import (Qt, QAbstractTableModel, QModelIndex, QObject, QRunnable, QSortFilterProxyModel,
+                          QThreadPool, QTimer, pyqtSignal)
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QLabel, QMenuBar, QMenu, QAction, QListWidget,
                              QLineEdit, QDialog, QFormLayout, QDialogButtonBox, QStatusBar, QInputDialog, QComboBox,
-                             QPushButton, QMessageBox, QFileDialog, QSpinBox, QHBoxLayout, QTableWidget, QTableWidgetItem)
+                             QPushButton, QMessageBox, QFileDialog, QSpinBox, QHBoxLayout, QTableWidget, QTableWidgetItem,
+                             QTableView, QAbstractItemView, QHeaderView, QProgressBar)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+import instrumentation
+import repository
+
+SEARCH_DELAY_MS = 300
+# Query threads never expire, so each keeps its one connection warm instead of
+# the global pool retiring idle threads and reopening connections later.
+QUERY_THREADS = 4
+# Title and genre orders are case-insensitive. SQLite's NOCASE folds ASCII
+# letters only, so the in-memory sorts fold the same way and agree with the
+# order rows are paged in.
+CASE_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+class QueryCancelled(Exception):
+    pass
+
+class WorkerSignals(QObject):
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+    progress = pyqtSignal(int)
+
+class QueryWorker(QRunnable):
+    # Runs one database call on a pool thread, which has its own connection
+    # from database.create_connection(). cancel() interrupts a statement that
+    # is still running; the executor drops results from cancelled workers.
+    def __init__(self, func, *args, **kwargs):
+        super().__init__()
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancelled = False
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            with self.lock:
+                self.conn = database.create_connection()
+            result = self.func(*self.args, **self.kwargs)
+        except QueryCancelled:
+            return
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.error.emit(str(e))
+            return
+        finally:
+            with self.lock:
+                self.conn = None
+        if not self.cancelled:
+            self.signals.result.emit(result)
+
+    def report(self, percent):
+        # Passed to long operations as their progress callback.
+        if self.cancelled:
+            raise QueryCancelled()
+        self.signals.progress.emit(percent)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.conn is not None:
+                self.conn.interrupt()
+
+class QueryExecutor(QObject):
+    # One worker per key: submitting again under a key cancels the previous
+    # query, and results or errors that arrive from it are ignored.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setExpiryTimeout(-1)
+        self.pool.setMaxThreadCount(QUERY_THREADS)
+        self.workers = {}
+
+    def submit(self, key, func, *args, on_result=None, on_error=None, on_progress=None):
+        self.cancel(key)
+        worker = QueryWorker(func, *args)
+        if on_progress:
+            worker.kwargs['progress'] = worker.report
+            worker.signals.progress.connect(lambda percent: self.current(key, worker) and on_progress(percent))
+        worker.signals.result.connect(lambda result: self.finish(key, worker, on_result, result))
+        worker.signals.error.connect(lambda message: self.finish(key, worker, on_error, message))
+        self.workers[key] = worker
+        self.pool.start(worker)
+        return worker
+
+    def current(self, key, worker):
+        return self.workers.get(key) is worker
+
+    def finish(self, key, worker, callback, value):
+        if not self.current(key, worker):
+            return
+        del self.workers[key]
+        if callback:
+            callback(value)
+
+    def cancel(self, key):
+        worker = self.workers.pop(key, None)
+        if worker:
+            worker.cancel()
+
+    def cancel_all(self):
+        for key in list(self.workers):
+            self.cancel(key)
+        self.pool.waitForDone()
+
+def fetch_anime(sql, params):
+    conn = database.create_connection()
+    return [repository.to_anime(row) for row in conn.execute(sql, params)]
+
+class CatalogStatistics:
+    # Running totals behind the statistics table. Edits adjust them in place;
+    # only removing the current highest rating needs another (indexed) query.
+    def __init__(self):
+        self.count = 0
+        self.rated = 0
+        self.total = 0.0
+        self.highest = None
+
+    def load(self, totals):
+        self.count, self.rated, self.total, self.highest = totals
+
+    def add(self, rating):
+        self.count += 1
+        if rating is not None:
+            self.rated += 1
+            self.total += rating
+            if self.highest is None or rating > self.highest:
+                self.highest = rating
+
+    def remove(self, rating):
+        # True when the highest rating may have gone and must be re-read.
+        self.count -= 1
+        if rating is None:
+            return False
+        self.rated -= 1
+        self.total -= rating
+        return self.highest is not None and rating >= self.highest
+
+    def average(self):
+        return self.total / self.rated if self.rated else None
+
+def import_anime(file_path, progress):
+    size = os.path.getsize(file_path) or 1
+    with open(file_path, 'rb') as raw:
+        reader = csv.reader(io.TextIOWrapper(raw, encoding='utf-8', newline=''))
+        next(reader)
+
+        def records():
+            for count, row in enumerate(reader, 1):
+                if len(row) == 3:
+                    title, genres, rating = row
+                    yield title, None, None, database.parse_rating(rating), database.split_genres(genres)
+                if count % 1000 == 0:
+                    progress(raw.tell() * 100 // size)
+
+        return repository.import_anime(records(), fast=True, truncate=True)
+
+def export_anime(file_path, progress):
+    total = database.get_catalog_summary()[0] or 1
+    return database.export_table('anime_details', file_path, columns=('title', 'genres', 'rating'),
+                                 progress=lambda count: progress(count * 100 // total))
 
 class AnimeEntryDialog(QDialog):
     def __init__(self, parent=None, title='', genre='', rating=''):
@@ -24,7 +196,7 @@ class AnimeEntryDialog(QDialog):
         self.rating_input.setText(rating)
 
         layout.addRow('Title:', self.title_input)
-        layout.addRow('Genre:', self.genre_input)
+        layout.addRow('Genres:', self.genre_input)
         layout.addRow('Rating (0-10):', self.rating_input)
         
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
@@ -46,6 +218,300 @@ class AnimeEntryDialog(QDialog):
         except ValueError:
             return False
 
+class TopRatedDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Top Rated Anime')
+        self.setGeometry(150, 150, 500, 600)
+        self.initUI()
+
+    def initUI(self):
+        layout = QVBoxLayout()
+        rows = database.get_top_rated()
+        table = QTableWidget(len(rows), 4, self)
+        table.setHorizontalHeaderLabels(['Title', 'Score', 'Reviews', 'Average'])
+        for i, (anime_id, title, score, count, average) in enumerate(rows):
+            table.setItem(i, 0, QTableWidgetItem(title))
+            table.setItem(i, 1, QTableWidgetItem(f'{score:.2f}'))
+            table.setItem(i, 2, QTableWidgetItem(str(count)))
+            table.setItem(i, 3, QTableWidgetItem(f'{average:.2f}'))
+        layout.addWidget(table)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Close, self)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+        self.setLayout(layout)
+
+class AnimeTableModel(QAbstractTableModel):
+    # Rows are paged in from SQLite as the view scrolls, keyed on the sort
+    # column and id, so opening the window reads a single batch and only
+    # rows the user has scrolled past are held in memory. Rows are
+    # repository.Anime tuples.
+    COLUMNS = ('title', 'genres', 'rating')
+    HEADERS = ('Title', 'Genres', 'Rating')
+    BATCH_SIZE = 200
+
+    failed = pyqtSignal(str)
+
+    def __init__(self, executor, parent=None):
+        super().__init__(parent)
+        self.executor = executor
+        self.rows = []
+        # anime id -> index in self.rows; None after a removal until needed.
+        self.positions = {}
+        # Nothing is read until the first reload(), once the schema exists.
+        self.exhausted = True
+        self.fetching = False
+        self.where = '1'
+        self.params = []
+        self.order = 'id'
+        self.descending = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        anime = self.rows[index.row()]
+        column = self.COLUMNS[index.column()]
+        if role == Qt.DisplayRole:
+            if column == 'genres':
+                return ', '.join(anime.genres)
+            return getattr(anime, column)
+        if role == Qt.TextAlignmentRole and column == 'rating':
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        # The batch is read on a worker thread and appended when it arrives.
+        if not self.canFetchMore(parent):
+            return
+        self.fetching = True
+        sql, params = self.batch_query()
+        self.executor.submit('fetch', fetch_anime, sql, params, on_result=self.add_batch, on_error=self.fetch_failed)
+
+    def add_batch(self, rows):
+        self.fetching = False
+        if len(rows) < self.BATCH_SIZE:
+            self.exhausted = True
+        # A row added locally while this batch was in flight is already here.
+        rows = [row for row in rows if self.position(row.id) is None]
+        if rows:
+            start = len(self.rows)
+            self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+            self.rows.extend(rows)
+            self.positions.update((row.id, start + offset) for offset, row in enumerate(rows))
+            self.endInsertRows()
+
+    def position(self, anime_id):
+        if self.positions is None:
+            self.positions = {row.id: index for index, row in enumerate(self.rows)}
+        return self.positions.get(anime_id)
+
+    def sort_value(self, row):
+        # The sort column as SQL orders it, genres as the group_concat text.
+        if self.order == 'genres':
+            return ','.join(row.genres).translate(CASE_FOLD) or None
+        if self.order == 'title':
+            return row.title.translate(CASE_FOLD)
+        return getattr(row, self.order)
+
+    def sort_expression(self):
+        return f'{self.order} COLLATE NOCASE' if self.order in ('title', 'genres') else self.order
+
+    def order_key(self, row):
+        if self.order == 'id':
+            return (row.id,)
+        # SQLite puts NULLs first.
+        value = self.sort_value(row)
+        return (value is not None, value, row.id)
+
+    def comes_before(self, row, other):
+        if self.descending:
+            return self.order_key(row) > self.order_key(other)
+        return self.order_key(row) < self.order_key(other)
+
+    def row_query(self, anime_id):
+        return (f'SELECT * FROM ({repository.ANIME_SELECT}) WHERE id = ? AND ({self.where})',
+                [anime_id] + list(self.params))
+
+    def apply_row(self, anime_id, row):
+        # row is anime_id as it now reads under this model's filter, or None
+        # if it was deleted or no longer matches.
+        position = self.position(anime_id)
+        if position is not None and position == len(self.rows) - 1 and not self.exhausted:
+            # The last loaded row anchors the next batch query; re-page
+            # rather than move or drop it.
+            if row is None or self.order_key(row) != self.order_key(self.rows[position]):
+                self.reload()
+                return
+        if position is not None and row is None:
+            self.beginRemoveRows(QModelIndex(), position, position)
+            del self.rows[position]
+            self.positions = None
+            self.endRemoveRows()
+        elif position is not None:
+            self.rows[position] = row
+            self.dataChanged.emit(self.index(position, 0), self.index(position, len(self.COLUMNS) - 1))
+        elif row is not None and (self.exhausted or (self.rows and not self.comes_before(self.rows[-1], row))):
+            # Rows past the last loaded one arrive with a later batch instead.
+            position = len(self.rows)
+            while position > 0 and self.comes_before(row, self.rows[position - 1]):
+                position -= 1
+            self.beginInsertRows(QModelIndex(), position, position)
+            self.rows.insert(position, row)
+            if position == len(self.rows) - 1:
+                self.positions[row.id] = position
+            else:
+                self.positions = None
+            self.endInsertRows()
+
+    def fetch_failed(self, message):
+        self.fetching = False
+        self.exhausted = True
+        self.failed.emit(message)
+
+    def batch_query(self):
+        direction, compare = ('DESC', '<') if self.descending else ('ASC', '>')
+        sql = f'SELECT * FROM ({repository.ANIME_SELECT}) WHERE ({self.where})'
+        params = list(self.params)
+        if self.rows:
+            last = self.rows[-1]
+            if self.order == 'id':
+                sql += f' AND id {compare} ?'
+                params.append(last.id)
+            else:
+                clause, values = database.keyset_clause(self.sort_expression(), self.sort_value(last), last.id,
+                                                        self.descending, 'id')
+                sql += f' AND {clause}'
+                params.extend(values)
+        if self.order == 'id':
+            sql += f' ORDER BY id {direction} LIMIT ?'
+        else:
+            sql += f' ORDER BY {self.sort_expression()} {direction}, id {direction} LIMIT ?'
+        params.append(self.BATCH_SIZE)
+        return sql, params
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.order = self.COLUMNS[column]
+        self.descending = order == Qt.DescendingOrder
+        self.reload()
+
+    def set_filter(self, where, params):
+        self.where = where
+        self.params = list(params)
+        self.reload()
+
+    def reload(self):
+        self.executor.cancel('fetch')
+        self.beginResetModel()
+        self.rows = []
+        self.positions = {}
+        self.exhausted = False
+        self.fetching = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def clear(self):
+        self.executor.cancel('fetch')
+        self.beginResetModel()
+        self.rows = []
+        self.positions = {}
+        self.exhausted = True
+        self.fetching = False
+        self.endResetModel()
+
+    def anime_at(self, row):
+        return self.rows[row]
+
+class AnimeFilterProxyModel(QSortFilterProxyModel):
+    # Genre and rating-range filtering plus multi-column ordering, evaluated
+    # in memory over the rows the source model has already loaded.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.genre = None
+        self.min_rating = 0
+        self.max_rating = 10
+        # (column, descending) pairs, primary key first.
+        self.sort_keys = []
+        # anime id -> (row, sort values). Keyed by id rather than source row
+        # because apply_row inserts and removes rows mid-list, and checked
+        # against the row object because it replaces edited rows in place.
+        self.sort_values = {}
+
+    def setSourceModel(self, model):
+        super().setSourceModel(model)
+        model.modelReset.connect(self.sort_values.clear)
+        model.rowsInserted.connect(self.fetch_if_sparse)
+
+    def set_filter(self, genre, min_rating, max_rating):
+        self.genre = genre
+        self.min_rating = min_rating
+        self.max_rating = max_rating
+        self.invalidateFilter()
+        self.fetch_if_sparse()
+
+    def fetch_if_sparse(self):
+        # A narrow filter can hide a whole batch, and the view only asks
+        # for more rows when it runs out of visible ones.
+        source = self.sourceModel()
+        if self.rowCount() < source.BATCH_SIZE and source.canFetchMore():
+            source.fetchMore()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        anime = self.sourceModel().anime_at(source_row)
+        if self.genre is not None and self.genre.casefold() not in (name.casefold() for name in anime.genres):
+            return False
+        if anime.rating is None:
+            # Unrated anime only show while the rating range is left open.
+            return self.min_rating == 0 and self.max_rating == 10
+        return self.min_rating <= anime.rating <= self.max_rating
+
+    def sort_by(self, column, descending):
+        self.sort_keys = [(column, descending)] + [key for key in self.sort_keys if key[0] != column]
+        self.sort_values.clear()
+        if self.sortColumn() < 0:
+            self.sort(0, Qt.AscendingOrder)
+        else:
+            # lessThan applies the keys and directions itself, so the proxy
+            # stays on column 0 ascending and only needs to re-sort.
+            self.invalidate()
+
+    def sort_value(self, source_row):
+        anime = self.sourceModel().anime_at(source_row)
+        cached = self.sort_values.get(anime.id)
+        if cached is not None and cached[0] is anime:
+            return cached[1]
+        rating = anime.rating if anime.rating is not None else float('-inf')
+        # Same keys as AnimeTableModel.sort_value, so rows paged in later
+        # land after the ones already shown.
+        values = (anime.title.translate(CASE_FOLD), ','.join(anime.genres).translate(CASE_FOLD), rating, anime.id)
+        self.sort_values[anime.id] = (anime, values)
+        return values
+
+    def lessThan(self, left, right):
+        a = self.sort_value(left.row())
+        b = self.sort_value(right.row())
+        for column, descending in self.sort_keys:
+            if a[column] != b[column]:
+                return a[column] > b[column] if descending else a[column] < b[column]
+        return a[-1] < b[-1]
+
+    def anime_at(self, row):
+        return self.sourceModel().anime_at(self.mapToSource(self.index(row, 0)).row())
+
 class AnimeListApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -64,6 +530,7 @@ class AnimeListApp(QMainWindow):
         search_action = QAction('Search Anime', self)
         export_action = QAction('Export to CSV', self)
         import_action = QAction('Import from CSV', self)
+        top_rated_action = QAction('Top Rated', self)
         exit_action = QAction('Exit', self)
 
         file_menu.addAction(add_action)
@@ -71,6 +538,7 @@ class AnimeListApp(QMainWindow):
         file_menu.addAction(search_action)
         file_menu.addAction(export_action)
         file_menu.addAction(import_action)
+        file_menu.addAction(top_rated_action)
         file_menu.addAction(exit_action)
 
         add_action.triggered.connect(self.show_add_anime_dialog)
@@ -78,12 +546,37 @@ class AnimeListApp(QMainWindow):
         search_action.triggered.connect(self.search_anime)
         export_action.triggered.connect(self.export_to_csv)
         import_action.triggered.connect(self.import_from_csv)
+        top_rated_action.triggered.connect(self.show_top_rated)
         exit_action.triggered.connect(self.close)
 
-        self.anime_list = QListWidget()
+        self.executor = QueryExecutor(self)
+        self.statistics = CatalogStatistics()
+        self.anime_model = AnimeTableModel(self.executor, self)
+        self.anime_model.failed.connect(lambda message: self.statusbar.showMessage(f'Query failed: {message}', 5000))
+        self.proxy_model = AnimeFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.anime_model)
+        self.anime_list = QTableView()
+        self.anime_list.setModel(self.proxy_model)
+        self.anime_list.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.anime_list.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.anime_list.verticalHeader().hide()
+        self.anime_list.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.anime_list.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.anime_list.horizontalHeader().setSectionsClickable(True)
+        self.anime_list.horizontalHeader().sectionClicked.connect(self.sort_by_column)
         self.anime_list.setContextMenuPolicy(3)
         self.anime_list.customContextMenuRequested.connect(self.show_context_menu)
 
+        self.search_box = QLineEdit(self)
+        self.search_box.setPlaceholderText('Search titles...')
+        self.search_box.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.apply_search)
+        self.search_box.textChanged.connect(lambda: self.search_timer.start())
+        self.search_box.returnPressed.connect(lambda: self.add_to_search_history(self.search_box.text()))
+
         self.sort_button = QPushButton('Sort by Title', self)
         self.sort_button.clicked.connect(self.sort_by_title)
 
@@ -145,6 +638,7 @@ class AnimeListApp(QMainWindow):
 
         welcome_label = QLabel('Welcome to the Anime List Database!', self)
         layout.addWidget(welcome_label)
+        layout.addWidget(self.search_box)
         layout.addWidget(self.anime_list)
         layout.addWidget(self.sort_button)
         layout.addLayout(filter_layout)
@@ -159,20 +653,19 @@ class AnimeListApp(QMainWindow):
 
         self.statusbar = QStatusBar()
         self.setStatusBar(self.statusbar)
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.hide()
+        self.cancel_button = QPushButton('Cancel', self)
+        self.cancel_button.clicked.connect(self.cancel_task)
+        self.cancel_button.hide()
+        self.statusbar.addPermanentWidget(self.progress_bar)
+        self.statusbar.addPermanentWidget(self.cancel_button)
 
     def setup_database(self):
-        conn = sqlite3.connect('anime_list.db')
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS anime (
-                id INTEGER PRIMARY KEY,
-                title TEXT NOT NULL,
-                genre TEXT NOT NULL,
-                rating REAL NOT NULL
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        # The schema is shared with the CLI and converted there if needed.
+        database.create_table()
 
     def show_add_anime_dialog(self):
         dialog = AnimeEntryDialog(self)
@@ -184,7 +677,6 @@ class AnimeListApp(QMainWindow):
             if not dialog.validate_rating(rating):
                 QMessageBox.warning(self, 'Warning', 'Rating must be a number between 0 and 10.')
                 return
-            self.anime_list.addItem(f'Title: {title}, Genre: {genre}, Rating: {rating}')
             self.save_data(title, genre, rating)
             self.statusbar.showMessage(f'Added: {title}', 5000)
             self.add_to_search_history(title)
@@ -199,22 +691,23 @@ class AnimeListApp(QMainWindow):
         remove_action = menu.addAction('Remove')
         action = menu.exec_(self.anime_list.viewport().mapToGlobal(pos))
 
-        selected_item = self.anime_list.currentItem()
+        selected = self.selected_anime()
         if action == edit_action:
-            if selected_item:
-                data = selected_item.text().split(', ')
-                title = data[0].replace('Title: ', '')
-                genre = data[1].replace('Genre: ', '')
-                rating = data[2].replace('Rating: ', '')
-                self.show_edit_anime_dialog(title, genre, rating)
+            if selected:
+                rating = '' if selected.rating is None else str(selected.rating)
+                self.show_edit_anime_dialog(selected.id, selected.title, ', '.join(selected.genres), rating)
         elif action == remove_action:
-            if selected_item:
-                title = selected_item.text().split(', ')[0].replace('Title: ', '')
-                self.anime_list.takeItem(self.anime_list.row(selected_item))
-                self.delete_data(title)
-                self.statusbar.showMessage(f'Removed: {title}', 5000)
+            if selected:
+                self.delete_data(selected.id)
+                self.statusbar.showMessage(f'Removed: {selected.title}', 5000)
+
+    def selected_anime(self):
+        index = self.anime_list.currentIndex()
+        if not index.isValid():
+            return None
+        return self.proxy_model.anime_at(index.row())
 
-    def show_edit_anime_dialog(self, title, genre, rating):
+    def show_edit_anime_dialog(self, anime_id, title, genre, rating):
         dialog = AnimeEntryDialog(self, title, genre, rating)
         if dialog.exec_() == QDialog.Accepted:
             new_title, new_genre, new_rating = dialog.get_data()
@@ -224,55 +717,54 @@ class AnimeListApp(QMainWindow):
             if not dialog.validate_rating(new_rating):
                 QMessageBox.warning(self, 'Warning', 'Rating must be a number between 0 and 10.')
                 return
-            self.update_data(title, new_title, new_genre, new_rating)
-            self.refresh_list()
+            self.update_data(anime_id, new_title, new_genre, new_rating)
             self.statusbar.showMessage(f'Updated: {new_title}', 5000)
 
     def save_data(self, title, genre, rating):
-        conn = sqlite3.connect('anime_list.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO anime (title, genre, rating) VALUES (?, ?, ?)", (title, genre, rating))
-        conn.commit()
-        conn.close()
-        self.refresh_list()
-
-    def delete_data(self, title):
-        conn = sqlite3.connect('anime_list.db')
-        c = conn.cursor()
-        c.execute("DELETE FROM anime WHERE title=?", (title,))
-        conn.commit()
-        conn.close()
-        self.refresh_list()
-
-    def update_data(self, old_title, new_title, new_genre, new_rating):
-        conn = sqlite3.connect('anime_list.db')
-        c = conn.cursor()
-        c.execute("UPDATE anime SET title=?, genre=?, rating=? WHERE title=?", (new_title, new_genre, new_rating, old_title))
-        conn.commit()
-        conn.close()
+        anime_id = repository.add_anime(title, rating=float(rating), genres=database.split_genres(genre))
+        self.row_changed(anime_id, None)
+
+    def delete_data(self, anime_id):
+        self.row_changed(anime_id, repository.delete_anime(anime_id))
+
+    def update_data(self, anime_id, new_title, new_genre, new_rating):
+        self.row_changed(anime_id, repository.update_anime(anime_id, title=new_title, rating=float(new_rating),
+                                                           genres=database.split_genres(new_genre)))
+
+    def row_changed(self, anime_id, old_row):
+        # Apply one written row to the view and the statistics instead of
+        # reloading: a primary-key read, and O(1) work on the totals.
+        conn = database.create_connection()
+        new_row = repository.get_anime(anime_id, conn)
+        refresh_highest = old_row is not None and self.statistics.remove(old_row.rating)
+        if new_row is not None:
+            self.statistics.add(new_row.rating)
+            new_row = conn.execute(*self.anime_model.row_query(anime_id)).fetchone()
+            new_row = new_row and repository.to_anime(new_row)
+        self.anime_model.apply_row(anime_id, new_row)
+        if refresh_highest:
+            self.update_statistics()
+        else:
+            self.show_statistics()
 
     def load_data(self):
-        conn = sqlite3.connect('anime_list.db')
-        c = conn.cursor()
-        c.execute("SELECT title, genre, rating FROM anime")
-        rows = c.fetchall()
-        conn.close()
-        self.anime_list.clear()
-        for row in rows:
-            title, genre, rating = row
-            self.anime_list.addItem(f'Title: {title}, Genre: {genre}, Rating: {rating}')
+        self.anime_model.reload()
         self.update_statistics()
 
     def refresh_list(self):
         self.load_data()
 
     def update_statistics(self):
-        conn = sqlite3.connect('anime_list.db')
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*), AVG(rating), MAX(rating) FROM anime")
-        result = c.fetchone()
-        conn.close()
-        total, avg_rating, highest_rating = result
+        self.executor.submit('statistics', database.get_catalog_totals, on_result=self.load_statistics)
+
+    def load_statistics(self, totals):
+        self.statistics.load(totals)
+        self.show_statistics()
+
+    def show_statistics(self):
+        total = self.statistics.count
+        avg_rating = self.statistics.average()
+        highest_rating = self.statistics.highest
         highest_rating = float(highest_rating) if highest_rating is not None else 0
         self.statistics_table.setRowCount(1)
         self.statistics_table.setItem(0, 0, QTableWidgetItem(str(total)))
@@ -280,126 +772,144 @@ class AnimeListApp(QMainWindow):
         self.statistics_table.setItem(0, 2, QTableWidgetItem(f'{highest_rating:.1f}' if highest_rating is not None else 'N/A'))
 
     def clear_list(self):
-        self.anime_list.clear()
+        self.anime_model.clear()
         self.statusbar.showMessage('List cleared', 5000)
 
     def clear_filters(self):
         self.filter_combobox.setCurrentIndex(0)
         self.rating_min_spinbox.setValue(0)
         self.rating_max_spinbox.setValue(10)
-        self.refresh_list()
+        self.search_box.clear()
+        self.search_timer.stop()
+        self.apply_filters()
+        self.apply_search()
 
     def search_anime(self):
-        text, ok = QInputDialog.getText(self, 'Search Anime', 'Enter anime title:')
-        if ok:
-            found = False
-            for i in range(self.anime_list.count()):
-                item = self.anime_list.item(i)
-                if text.lower() in item.text().lower():
-                    self.anime_list.setCurrentItem(item)
-                    self.statusbar.showMessage(f'Found: {text}', 5000)
-                    found = True
-                    break
-            if not found:
-                self.statusbar.showMessage(f'No anime found with title: {text}', 5000)
-            self.add_to_search_history(text)
+        self.search_box.setFocus()
+        self.search_box.selectAll()
 
     def sort_by_title(self):
-        self.anime_list.sortItems()
+        self.sort_by(0, False)
 
     def sort_by_genre(self):
-        items = [self.anime_list.item(i) for i in range(self.anime_list.count())]
-        sorted_items = sorted(items, key=lambda x: x.text().split(', ')[1].replace('Genre: ', ''))
-        self.anime_list.clear()
-        for item in sorted_items:
-            self.anime_list.addItem(item.text())
+        self.sort_by(1, False)
+
+    def sort_by_column(self, column):
+        keys = self.proxy_model.sort_keys
+        descending = not keys[0][1] if keys and keys[0][0] == column else False
+        self.sort_by(column, descending)
+
+    def sort_by(self, column, descending):
+        # Earlier sort columns stay on as tie-breakers. While rows are still
+        # being paged in, the source is re-queried in the new primary order
+        # so that later batches land after the ones already shown.
+        if self.anime_model.canFetchMore() or self.anime_model.fetching:
+            self.anime_model.sort(column, Qt.DescendingOrder if descending else Qt.AscendingOrder)
+        self.proxy_model.sort_by(column, descending)
+        header = self.anime_list.horizontalHeader()
+        header.setSortIndicatorShown(True)
+        header.setSortIndicator(column, Qt.DescendingOrder if descending else Qt.AscendingOrder)
 
     def filter_by_genre(self, index):
-        genre = self.filter_combobox.currentText()
-        conn = sqlite3.connect('anime_list.db')
-        c = conn.cursor()
-        if genre == 'All Genres':
-            c.execute("SELECT title, genre, rating FROM anime")
-        else:
-            c.execute("SELECT title, genre, rating FROM anime WHERE genre=?", (genre,))
-        rows = c.fetchall()
-        conn.close()
-        self.anime_list.clear()
-        for row in rows:
-            title, genre, rating = row
-            self.anime_list.addItem(f'Title: {title}, Genre: {genre}, Rating: {rating}')
-        self.statusbar.showMessage(f'Filtered by genre: {genre}', 5000)
+        self.apply_filters()
 
     def filter_by_rating(self):
+        self.apply_filters()
+
+    def apply_filters(self):
+        genre = self.filter_combobox.currentText()
         min_rating = self.rating_min_spinbox.value()
         max_rating = self.rating_max_spinbox.value()
-        conn = sqlite3.connect('anime_list.db')
-        c = conn.cursor()
-        c.execute("SELECT title, genre, rating FROM anime WHERE rating BETWEEN ? AND ?", (min_rating, max_rating))
-        rows = c.fetchall()
-        conn.close()
-        self.anime_list.clear()
-        for row in rows:
-            title, genre, rating = row
-            self.anime_list.addItem(f'Title: {title}, Genre: {genre}, Rating: {rating}')
-        self.statusbar.showMessage(f'Filtered by rating: {min_rating} - {max_rating}', 5000)
+        self.proxy_model.set_filter(None if genre == 'All Genres' else genre, min_rating, max_rating)
+        self.statusbar.showMessage(f'Filtered by genre: {genre}, rating: {min_rating} - {max_rating}', 5000)
+
+    def apply_search(self):
+        text = self.search_box.text().strip()
+        where = '1'
+        params = []
+        if text:
+            query = database.build_match_query(text)
+            if query and database.has_search_index():
+                where = "id IN (SELECT rowid FROM anime_fts WHERE anime_fts MATCH ?)"
+                params.append(query)
+            else:
+                where = "title LIKE ?"
+                params.append('%' + text + '%')
+        self.anime_model.set_filter(where, params)
 
     def export_to_csv(self):
-        file_path, _ = QFileDialog.getSaveFileName(self, 'Export to CSV', '', 'CSV Files (*.csv)')
+        file_path, _ = QFileDialog.getSaveFileName(self, 'Export to CSV', '',
+                                                   'CSV Files (*.csv);;JSON Lines (*.jsonl);;Compressed CSV (*.csv.gz)')
         if file_path:
-            conn = sqlite3.connect('anime_list.db')
-            c = conn.cursor()
-            c.execute("SELECT title, genre, rating FROM anime")
-            rows = c.fetchall()
-            conn.close()
-            with open(file_path, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(['Title', 'Genre', 'Rating'])
-                writer.writerows(rows)
-            self.statusbar.showMessage(f'Exported to {file_path}', 5000)
+            self.start_task('Exporting', export_anime, file_path,
+                            on_result=lambda count: self.statusbar.showMessage(
+                                f'Exported {count} rows to {file_path}', 5000))
 
     def import_from_csv(self):
         file_path, _ = QFileDialog.getOpenFileName(self, 'Import from CSV', '', 'CSV Files (*.csv)')
         if file_path:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                next(reader)
-                conn = sqlite3.connect('anime_list.db')
-                c = conn.cursor()
-                c.execute("DELETE FROM anime")
-                for row in reader:
-                    if len(row) == 3:
-                        c.execute("INSERT INTO anime (title, genre, rating) VALUES (?, ?, ?)", row)
-                conn.commit()
-                conn.close()
-            self.refresh_list()
-            self.statusbar.showMessage(f'Imported from {file_path}', 5000)
+            self.start_task('Importing', import_anime, file_path,
+                            on_result=lambda stats: self.finish_import(file_path, stats))
+
+    def finish_import(self, file_path, stats):
+        self.refresh_list()
+        self.statusbar.showMessage(f'Imported {stats.rows} rows from {file_path} ({stats.rows_per_second:.0f} rows/s)', 5000)
+
+    def start_task(self, label, func, *args, on_result):
+        # Long operations share one 'task' slot with a progress bar; starting
+        # another one cancels the first.
+        def done(result):
+            self.end_task()
+            on_result(result)
+
+        def failed(message):
+            self.end_task()
+            QMessageBox.warning(self, 'Error', f'{label} failed: {message}')
+
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat(f'{label} %p%')
+        self.progress_bar.show()
+        self.cancel_button.show()
+        self.executor.submit('task', func, *args, on_result=done, on_error=failed,
+                             on_progress=self.progress_bar.setValue)
+
+    def end_task(self):
+        self.progress_bar.hide()
+        self.cancel_button.hide()
+
+    def cancel_task(self):
+        self.executor.cancel('task')
+        self.end_task()
+        self.statusbar.showMessage('Cancelled', 5000)
+
+    def closeEvent(self, event):
+        self.executor.cancel_all()
+        super().closeEvent(event)
+
+    def show_top_rated(self):
+        TopRatedDialog(self).exec_()
 
     def view_details(self):
-        selected_item = self.anime_list.currentItem()
-        if selected_item:
-            data = selected_item.text().split(', ')
-            title = data[0].replace('Title: ', '')
-            genre = data[1].replace('Genre: ', '')
-            rating = data[2].replace('Rating: ', '')
-            QMessageBox.information(self, 'Anime Details', f'Title: {title}\nGenre: {genre}\nRating: {rating}')
+        selected = self.selected_anime()
+        if selected:
+            details = [f'Title: {selected.title}', f'Genres: {", ".join(selected.genres)}']
+            if selected.episodes is not None:
+                details.append(f'Episodes: {selected.episodes}')
+            if selected.status:
+                details.append(f'Status: {selected.status}')
+            details.append(f'Rating: {selected.rating if selected.rating is not None else "N/A"}')
+            QMessageBox.information(self, 'Anime Details', '\n'.join(details))
 
     def rate_anime(self):
-        selected_item = self.anime_list.currentItem()
-        if selected_item:
-            data = selected_item.text().split(', ')
-            title = data[0].replace('Title: ', '')
+        selected = self.selected_anime()
+        if selected:
             rating, ok = QInputDialog.getDouble(self, 'Rate Anime', 'Enter new rating (0-10):', 0, 0, 10, 1)
             if ok:
-                conn = sqlite3.connect('anime_list.db')
-                c = conn.cursor()
-                c.execute("UPDATE anime SET rating=? WHERE title=?", (rating, title))
-                conn.commit()
-                conn.close()
-                self.refresh_list()
-                self.statusbar.showMessage(f'Updated rating for {title}', 5000)
+                self.row_changed(selected.id, repository.update_anime(selected.id, rating=rating))
+                self.statusbar.showMessage(f'Updated rating for {selected.title}', 5000)
 
 if __name__ == '__main__':
+    instrumentation.enable_from_environment()
     app = QApplication(sys.argv)
     main_window = AnimeListApp()
     main_window.show()
@@ -0,0 +1,231 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import write_queue
+
+READER_THREADS = 4
+MAX_PENDING_WRITES = 100
+
+# Every write goes through one thread so async callers never fight over the
+# SQLite write lock; reads fan out over a small pool. Each worker thread gets
+# its own long-lived connection from database.create_connection().
+_lock = threading.Lock()
+_reader_pool = None
+_writer = None
+_write_slots = None
+_write_slots_loop = None
+
+def start(readers=READER_THREADS):
+    global _reader_pool, _writer
+    with _lock:
+        if _writer is None:
+            _reader_pool = ThreadPoolExecutor(readers, thread_name_prefix='anime-db-reader')
+            _writer = ThreadPoolExecutor(1, thread_name_prefix='anime-db-writer')
+
+def shutdown():
+    global _reader_pool, _writer, _write_slots, _write_slots_loop
+    with _lock:
+        pools = (_reader_pool, _writer)
+        _reader_pool = _writer = _write_slots = _write_slots_loop = None
+    for pool in pools:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    database.shutdown()
+
+async def close():
+    await asyncio.get_running_loop().run_in_executor(None, shutdown)
+
+def write_slots():
+    global _write_slots, _write_slots_loop
+    loop = asyncio.get_running_loop()
+    if _write_slots_loop is not loop:
+        _write_slots = asyncio.Semaphore(MAX_PENDING_WRITES)
+        _write_slots_loop = loop
+    return _write_slots
+
+async def read(func, *args, **kwargs):
+    start()
+    future = _reader_pool.submit(func, *args, **kwargs)
+    return await asyncio.wrap_future(future)
+
+async def write(func, *args, **kwargs):
+    start()
+    loop = asyncio.get_running_loop()
+    slots = write_slots()
+    # Waits here once MAX_PENDING_WRITES writes are queued or running.
+    await slots.acquire()
+    try:
+        future = _writer.submit(func, *args, **kwargs)
+    except BaseException:
+        slots.release()
+        raise
+
+    def release(_):
+        try:
+            loop.call_soon_threadsafe(slots.release)
+        except RuntimeError:
+            pass
+
+    # The slot is held until the write really finishes, even if the caller
+    # is cancelled while the statement is already running.
+    future.add_done_callback(release)
+    return await asyncio.wrap_future(future)
+
+async def queued_write(name, *args):
+    # Group-committed through write_queue instead of the writer thread; see
+    # write_queue.OPERATIONS for the writes it takes.
+    return await asyncio.wrap_future(write_queue.submit(name, *args))
+
+async def create_table():
+    return await write(database.create_table)
+
+async def migrate():
+    return await write(database.migrate)
+
+async def rebuild_search_index():
+    return await write(database.rebuild_search_index)
+
+async def rebuild_rating_summary():
+    return await write(database.rebuild_rating_summary)
+
+async def get_rating_summary(anime_id):
+    return await read(database.get_rating_summary, anime_id)
+
+async def get_global_rating_summary():
+    return await read(database.get_global_rating_summary)
+
+async def get_most_reviewed_anime(limit=10):
+    return await read(database.get_most_reviewed_anime, limit)
+
+async def get_catalog_totals():
+    return await read(database.get_catalog_totals)
+
+async def get_catalog_summary():
+    return await read(database.get_catalog_summary)
+
+async def refresh_rankings(weight=database.RANKING_PRIOR_WEIGHT):
+    return await write(database.refresh_rankings, weight)
+
+async def ranking_drift():
+    return await read(database.ranking_drift)
+
+async def get_top_rated(limit=database.TOP_RATED_LIMIT, genre_id=None, status=None):
+    return await read(database.get_top_rated, limit, genre_id, status)
+
+async def rebuild_trigram_index():
+    return await write(database.rebuild_trigram_index)
+
+async def search_anime(text, limit=20, prefix=True):
+    return await read(database.search_anime, text, limit, prefix)
+
+async def search_reviews(text, limit=20, prefix=True):
+    return await read(database.search_reviews, text, limit, prefix)
+
+async def insert_many(table, columns, rows, batch_size=database.BULK_BATCH_SIZE, fast=False, truncate=False):
+    return await write(database.insert_many, table, columns, rows, batch_size, fast, truncate)
+
+async def add_anime_many(rows, batch_size=database.BULK_BATCH_SIZE, fast=False):
+    return await write(database.add_anime_many, rows, batch_size, fast)
+
+async def add_reviews_many(rows, batch_size=database.BULK_BATCH_SIZE, fast=False):
+    return await write(database.add_reviews_many, rows, batch_size, fast)
+
+async def add_genres_many(names, batch_size=database.BULK_BATCH_SIZE, fast=False):
+    return await write(database.add_genres_many, names, batch_size, fast)
+
+async def add_review(user_id, anime_id, rating, review):
+    return await write(database.add_review, user_id, anime_id, rating, review)
+
+async def update_review(review_id, rating, review):
+    return await write(database.update_review, review_id, rating, review)
+
+async def upsert_review(user_id, anime_id, rating, review):
+    return await write(database.upsert_review, user_id, anime_id, rating, review)
+
+async def upsert_reviews(rows, batch_size=database.BULK_BATCH_SIZE):
+    return await write(database.upsert_reviews, rows, batch_size)
+
+async def delete_review(review_id):
+    return await write(database.delete_review, review_id)
+
+async def get_reviews_for_anime(anime_id):
+    return await read(database.get_reviews_for_anime, anime_id)
+
+async def get_user_reviews(user_id):
+    return await read(database.get_user_reviews, user_id)
+
+async def add_anime(title, episodes, status):
+    return await write(database.add_anime, title, episodes, status)
+
+async def update_anime(anime_id, title, episodes, status):
+    return await write(database.update_anime, anime_id, title, episodes, status)
+
+async def delete_anime(anime_id):
+    return await write(database.delete_anime, anime_id)
+
+async def get_all_anime():
+    return await read(database.get_all_anime)
+
+async def get_anime_page(order='id', token=None, page_size=database.PAGE_SIZE, descending=False):
+    return await read(database.get_anime_page, order, token, page_size, descending)
+
+async def get_anime_by_id(anime_id):
+    return await read(database.get_anime_by_id, anime_id)
+
+async def search_anime_by_title(title):
+    return await read(database.search_anime_by_title, title)
+
+async def filter_anime_by_genre(genre_id):
+    return await read(database.filter_anime_by_genre, genre_id)
+
+async def filter_anime_by_status(status):
+    return await read(database.filter_anime_by_status, status)
+
+async def search_anime_by_genres(genre_ids):
+    return await read(database.search_anime_by_genres, genre_ids)
+
+async def filter_anime_by_statuses(statuses):
+    return await read(database.filter_anime_by_statuses, statuses)
+
+async def export_table(source, filename, columns=None, where=None, params=(), fmt=None,
+                       chunk_size=database.EXPORT_CHUNK_SIZE, progress=None):
+    return await read(database.export_table, source, filename, columns, where, params, fmt, chunk_size, progress)
+
+async def export_to_csv(filename):
+    return await read(database.export_to_csv, filename)
+
+async def import_from_csv(filename, batch_size=database.BULK_BATCH_SIZE, fast=True):
+    return await write(database.import_from_csv, filename, batch_size, fast)
+
+async def backup_database(pages=database.BACKUP_PAGES_PER_STEP, compress=False, keep=database.BACKUP_KEEP,
+                          verify=True, progress=None):
+    return await read(database.backup_database, pages, compress, keep, verify, progress)
+
+async def add_preference(user_id, key, value):
+    return await write(database.add_preference, user_id, key, value)
+
+async def update_preference(user_id, key, value):
+    return await write(database.update_preference, user_id, key, value)
+
+async def set_preferences(user_id, preferences):
+    return await write(database.set_preferences, user_id, preferences)
+
+async def delete_preference(user_id, key):
+    return await write(database.delete_preference, user_id, key)
+
+async def get_preferences(user_id):
+    return await read(database.get_preferences, user_id)
+
+async def add_genre(name):
+    return await write(database.add_genre, name)
+
+async def update_genre(genre_id, new_name):
+    return await write(database.update_genre, genre_id, new_name)
+
+async def delete_genre(genre_id):
+    return await write(database.delete_genre, genre_id)
+
+async def get_all_genres():
+    return await read(database.get_all_genres)
@@ -0,0 +1,208 @@
+import argparse
+import math
+import os
+import random
+import time
+from collections import namedtuple
+
+import database
+import repository
+
+# python -m benchmarks.generate --preset large --db bench.db
+Scale = namedtuple('Scale', ['anime', 'genres', 'users', 'reviews'])
+
+PRESETS = {
+    'tiny': Scale(500, 20, 100, 5000),
+    'small': Scale(10000, 50, 2000, 200000),
+    'medium': Scale(100000, 50, 20000, 2000000),
+    'large': Scale(1000000, 50, 100000, 20000000),
+}
+DEFAULT_SEED = 20240101
+
+# Popularity follows a Zipf law over a shuffled ranking, so a few hundred
+# anime and genres collect most of the reviews but ids say nothing about it.
+ANIME_SKEW = 1.0
+GENRE_SKEW = 1.1
+# Reviews per user are log-normal: most users write a handful, a few write
+# thousands. Counts are capped at the catalog size.
+ACTIVITY_SIGMA = 1.2
+QUALITY_MEAN = 6.8
+QUALITY_SPREAD = 1.2
+USER_BIAS_SPREAD = 0.8
+RATING_NOISE = 1.3
+UNRATED_SHARE = 0.03
+REVIEW_TEXT_SHARE = 0.1
+
+GENRE_NAMES = [
+    'Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Romance', 'Slice of Life', 'Sci-Fi', 'Mystery',
+    'Horror', 'Sports', 'Supernatural', 'Mecha', 'Music', 'Psychological', 'Thriller', 'Isekai', 'Historical',
+    'Military', 'School', 'Shounen', 'Shoujo', 'Seinen', 'Josei', 'Magic', 'Martial Arts', 'Space', 'Parody',
+    'Police', 'Samurai', 'Vampire', 'Demons', 'Game', 'Harem', 'Idols', 'Kids', 'Cars', 'Super Power',
+    'Detective', 'Gourmet', 'Workplace', 'Survival', 'Time Travel', 'Reincarnation', 'Post-Apocalyptic',
+    'Cyberpunk', 'Mythology', 'Medical', 'Racing', 'Strategy',
+]
+TITLE_WORDS = [
+    'Attack', 'Titan', 'Blade', 'Sword', 'Spirit', 'Ghost', 'Shadow', 'Dragon', 'Moon', 'Sun', 'Star', 'Sky',
+    'Ocean', 'Fire', 'Ice', 'Storm', 'Thunder', 'Blossom', 'Sakura', 'Kaiju', 'Ninja', 'Samurai', 'Demon',
+    'Slayer', 'Hunter', 'Alchemist', 'Knight', 'Witch', 'Wizard', 'Academy', 'Hero', 'Legend', 'Chronicle',
+    'Journey', 'Quest', 'Tale', 'Saga', 'Requiem', 'Symphony', 'Melody', 'Café', 'Garden', 'City', 'Tokyo',
+    'Kyoto', 'Osaka', 'Galaxy', 'Planet', 'Machine', 'Steel', 'Iron', 'Crimson', 'Azure', 'Golden', 'Silver',
+    'Eternal', 'Last', 'First', 'Lost', 'Hidden', 'Forbidden', 'Secret', 'Silent', 'Broken', 'Wandering',
+    'Little', 'Great', 'Brave', 'Lonely', 'Happy', 'Jujutsu', 'Kaisen', 'Naruto', 'Bleach', 'Haikyuu',
+    'Frieren', 'Clannad', 'Monogatari', 'Mushishi', 'Evangelion', 'Gintama', 'Yotsuba', 'Kimi', 'Sekai',
+    'Tenshi', 'Yume', 'Kokoro', 'Hikari', 'Sora', 'Kaze', 'Mirai', 'Days', 'Nights', 'Wings', 'Hearts',
+    'Gate', 'Tower', 'Dungeon', 'Kingdom', 'Empire', 'Rebellion', 'Code', 'Zero', 'Infinity', 'Paradox',
+]
+TITLE_SUFFIXES = ['', '', '', '', ' Season 2', ' Season 3', ' II', ' Zero', ' Movie', ' OVA', ' Final Season']
+STATUSES = [('Completed', 70), ('Ongoing', 15), ('Upcoming', 8), ('Hiatus', 4), ('Cancelled', 3)]
+EPISODE_COUNTS = [(1, 8), (12, 30), (13, 15), (24, 15), (25, 8), (26, 8), (50, 5), (64, 2), (100, 2),
+                  (220, 1), (500, 1), (None, 5)]
+REVIEW_WORDS = [
+    'great', 'boring', 'animation', 'story', 'characters', 'pacing', 'ending', 'soundtrack', 'opening',
+    'villain', 'plot', 'twist', 'fights', 'slow', 'beautiful', 'masterpiece', 'overrated', 'underrated',
+    'emotional', 'funny', 'dark', 'rewatch', 'filler', 'arc', 'season', 'art', 'studio', 'adaptation',
+    'manga', 'recommend', 'dropped', 'cried', 'hype', 'worldbuilding', 'romance', 'comedy', 'action',
+]
+PREFERENCE_VALUES = {
+    'theme': ['light', 'dark'],
+    'language': ['sub', 'dub'],
+    'spoilers': ['hide', 'show'],
+    'list_order': ['title', 'rating', 'recent'],
+}
+
+def zipf_cum_weights(count, skew):
+    total = 0.0
+    weights = []
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** skew
+        weights.append(total)
+    return weights
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+class CatalogGenerator:
+    # Every draw comes from one Random(seed) in a fixed order, so a seed and
+    # a Scale always produce byte-for-byte the same rows.
+    def __init__(self, scale, seed=DEFAULT_SEED):
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.genre_names = (GENRE_NAMES + [f'Genre {n}' for n in range(len(GENRE_NAMES) + 1, scale.genres + 1)])[
+            :scale.genres]
+        self.genre_ranking = self.shuffled(self.genre_names)
+        self.genre_weights = zipf_cum_weights(scale.genres, GENRE_SKEW)
+        self.anime_ranking = self.shuffled(range(1, scale.anime + 1))
+        self.anime_weights = zipf_cum_weights(scale.anime, ANIME_SKEW)
+        self.quality = [0.0] + [self.rng.gauss(QUALITY_MEAN, QUALITY_SPREAD) for _ in range(scale.anime)]
+
+    def shuffled(self, values):
+        values = list(values)
+        self.rng.shuffle(values)
+        return values
+
+    def title(self):
+        words = self.rng.sample(TITLE_WORDS, self.rng.randint(1, 4))
+        return ' '.join(words) + self.rng.choice(TITLE_SUFFIXES)
+
+    def anime(self):
+        # (title, episodes, status, rating, genres) as repository.import_anime
+        # takes them. Ids are handed out from 1 in this order.
+        rng = self.rng
+        for anime_id in range(1, self.scale.anime + 1):
+            count = rng.choice((1, 1, 2, 2, 2, 3, 3, 4))
+            genres = list(dict.fromkeys(rng.choices(self.genre_ranking, cum_weights=self.genre_weights, k=count)))
+            rating = None
+            if rng.random() >= UNRATED_SHARE:
+                rating = round(clamp(self.quality[anime_id], 0, 10), 2)
+            yield self.title(), weighted(rng, EPISODE_COUNTS), weighted(rng, STATUSES), rating, genres
+
+    def users(self):
+        for user_id in range(1, self.scale.users + 1):
+            yield user_id, f'user{user_id:07d}', f'password{user_id}'
+
+    def activity(self):
+        # Review count per user, scaled so the total lands near scale.reviews.
+        weights = [math.exp(self.rng.gauss(0, ACTIVITY_SIGMA)) for _ in range(self.scale.users)]
+        factor = self.scale.reviews / sum(weights) if weights else 0
+        counts = []
+        carry = 0.0
+        for weight in weights:
+            carry += weight * factor
+            count = int(carry)
+            carry -= count
+            counts.append(min(count, self.scale.anime))
+        return counts
+
+    def rated_anime(self, count):
+        # count distinct anime, drawn by popularity and topped up uniformly
+        # once the popular ones are exhausted.
+        rng = self.rng
+        picked = dict.fromkeys(rng.choices(self.anime_ranking, cum_weights=self.anime_weights, k=count))
+        while len(picked) < count:
+            picked.setdefault(rng.randint(1, self.scale.anime))
+        return list(picked)
+
+    def reviews(self):
+        # (user_id, anime_id, rating, review); at most one per user and anime.
+        rng = self.rng
+        for user_id, count in enumerate(self.activity(), 1):
+            bias = rng.gauss(0, USER_BIAS_SPREAD)
+            for anime_id in self.rated_anime(count):
+                rating = None
+                if rng.random() >= UNRATED_SHARE:
+                    rating = clamp(round(rng.gauss(self.quality[anime_id] + bias, RATING_NOISE)), 1, 10)
+                review = None
+                if rng.random() < REVIEW_TEXT_SHARE:
+                    review = ' '.join(rng.choices(REVIEW_WORDS, k=rng.randint(5, 20)))
+                yield user_id, anime_id, rating, review
+
+    def preferences(self):
+        rng = self.rng
+        for user_id in range(1, self.scale.users + 1):
+            for key in rng.sample(sorted(PREFERENCE_VALUES), rng.randint(0, 3)):
+                yield user_id, key, rng.choice(PREFERENCE_VALUES[key])
+
+def report(label, stats):
+    print(f"{label}: {stats.rows} rows in {stats.seconds:.1f}s ({stats.rows_per_second:.0f} rows/s)")
+
+def generate(path, scale, seed=DEFAULT_SEED, batch_size=database.BULK_BATCH_SIZE):
+    # Builds a fresh database at path. Tables are loaded in the order the
+    # generator draws them, so the file only depends on scale and seed.
+    if os.path.exists(path):
+        raise FileExistsError(f'{path} already exists')
+    database.configure(path=path)
+    database.create_table()
+    generator = CatalogGenerator(scale, seed)
+    report('genres', database.add_genres_many(generator.genre_names, batch_size, fast=True))
+    report('users', database.insert_many('users', ('id', 'username', 'password'), generator.users(),
+                                         batch_size, fast=True))
+    report('preferences', database.insert_many('preferences', ('user_id', 'key', 'value'), generator.preferences(),
+                                               batch_size, fast=True))
+    report('anime', repository.import_anime(generator.anime(), batch_size, fast=True))
+    report('reviews', database.add_reviews_many(generator.reviews(), batch_size, fast=True))
+    started = time.perf_counter()
+    database.refresh_rankings()
+    conn = database.create_connection()
+    conn.execute('ANALYZE')
+    print(f"rankings and statistics: {time.perf_counter() - started:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic anime catalog for benchmarking')
+    parser.add_argument('--db', required=True, help='database file to create')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    for field in Scale._fields:
+        parser.add_argument(f'--{field}', type=int, help=f'override the preset number of {field}')
+    parser.add_argument('--batch-size', type=int, default=database.BULK_BATCH_SIZE)
+    args = parser.parse_args()
+    scale = PRESETS[args.preset]._replace(**{field: getattr(args, field) for field in Scale._fields
+                                               if getattr(args, field) is not None})
+    print(f"Generating {scale} with seed {args.seed} into {args.db}")
+    generate(args.db, scale, args.seed, args.batch_size)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+import argparse
+import inspect
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import cache
+import database
+
+# python -m benchmarks.harness run --db bench.db --out before.json
+# python -m benchmarks.harness compare before.json after.json
+ITERATIONS = 30
+HEAVY_ITERATIONS = 3
+PERCENTILES = (50, 95, 99)
+# A benchmark regresses when p50 or p95 grows by more than this fraction
+# and by more than MIN_DELTA_MS, so sub-millisecond jitter is not flagged.
+REGRESSION_THRESHOLD = 0.10
+MIN_DELTA_MS = 0.05
+
+# args(ctx) returns the call's arguments and is not timed; neither is
+# cleanup(marks, args), which undoes whatever a write changed so every
+# iteration sees the same data. marks holds each table's largest rowid from
+# just before args() ran. Heavy benchmarks scan or rewrite whole tables and
+# only run with --heavy.
+Benchmark = namedtuple('Benchmark', ['name', 'func', 'args', 'cleanup', 'heavy'], defaults=(None, False))
+
+MARKED_TABLES = ('anime', 'reviews', 'genre')
+
+# Public database.py functions that are not timed, and why.
+SKIPPED = {
+    **dict.fromkeys(['configure', 'open_connection', 'open_connections', 'create_connection', 'close_connection',
+                     'shutdown'],
+                    'connection management, run around every benchmark'),
+    **dict.fromkeys(['migrate', 'ensure_schema', 'create_table', 'main'], 'schema setup'),
+    **dict.fromkeys(['title_trigrams', 'parse_rating', 'split_genres', 'build_match_query', 'batched',
+                     'encode_page_token', 'decode_page_token', 'keyset_clause', 'export_format',
+                     'summarize_ratings', 'histogram_delta', 'summary_delta', 'summary_row', 'backup_prefix',
+                     'parse_episodes', 'positive_int'],
+                    'pure helper without I/O'),
+    **dict.fromkeys(['bulk_load', 'insert_many', 'add_genres_many', 'import_from_csv', 'export_to_csv',
+                     'open_export_file', 'prune_backups', 'verify_backup'],
+                    'covered by the add_*_many, export_table and backup_database benchmarks'),
+}
+
+class Context:
+    # What the argument builders draw from: id ranges of the database under
+    # test and a seeded Random, so two runs issue the same calls.
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        conn = database.create_connection()
+        self.max_anime = conn.execute('SELECT IFNULL(MAX(id), 1) FROM anime').fetchone()[0]
+        self.max_user = conn.execute('SELECT IFNULL(MAX(id), 1) FROM users').fetchone()[0]
+        self.genre_ids = [genre_id for genre_id, in conn.execute('SELECT id FROM genre')] or [1]
+        self.statuses = [status for status, in conn.execute('SELECT DISTINCT status FROM anime WHERE status IS NOT NULL')]
+        self.words = [title.split()[0] for title, in conn.execute(
+            "SELECT title FROM anime WHERE title <> '' ORDER BY id LIMIT 200")] or ['anime']
+        self.tmpdir = tempfile.mkdtemp(prefix='anime-bench-')
+
+    def anime_id(self):
+        return self.rng.randint(1, self.max_anime)
+
+    def user_id(self):
+        return self.rng.randint(1, self.max_user)
+
+    def genre_id(self):
+        return self.rng.choice(self.genre_ids)
+
+    def status(self):
+        return self.rng.choice(self.statuses) if self.statuses else 'Completed'
+
+    def word(self):
+        return self.rng.choice(self.words)
+
+    def unreviewed(self, taken=()):
+        # A (user_id, anime_id) pair without a review, as each user can
+        # review an anime only once.
+        conn = database.create_connection()
+        while True:
+            pair = (self.user_id(), self.anime_id())
+            if pair not in taken and not conn.execute(
+                    'SELECT 1 FROM reviews WHERE user_id = ? AND anime_id = ?', pair).fetchone():
+                return pair
+
+    def page_token(self, order):
+        _, token = database.get_anime_page(order)
+        return token
+
+    def marks(self):
+        conn = database.create_connection()
+        return {table: conn.execute(f'SELECT IFNULL(MAX(rowid), 0) FROM {table}').fetchone()[0]
+                for table in MARKED_TABLES}
+
+def remove_rows_after(marks, args=None):
+    # Deletes whatever was inserted since marks, keeping the trigram index
+    # in step for anime.
+    conn = database.create_connection()
+    with conn:
+        for anime_id, in conn.execute('SELECT id FROM anime WHERE id > ?', (marks['anime'],)).fetchall():
+            conn.execute('DELETE FROM anime WHERE id = ?', (anime_id,))
+            database.unindex_title(conn, anime_id)
+        conn.execute('DELETE FROM reviews WHERE id > ?', (marks['reviews'],))
+        conn.execute('DELETE FROM genre WHERE id > ?', (marks['genre'],))
+    cache.clear()
+
+def remove_preference(marks, args):
+    database.delete_preference(args[0], 'benchmark')
+
+def remove_preferences(marks, args):
+    for key in args[1]:
+        database.delete_preference(args[0], key)
+
+def new_review(ctx):
+    database.add_review(*ctx.unreviewed(), 5, 'benchmark review')
+    return ctx.marks()['reviews']
+
+def reviewed_pair(ctx):
+    user_id, anime_id = ctx.unreviewed()
+    database.add_review(user_id, anime_id, 5, 'benchmark review')
+    return user_id, anime_id
+
+def new_anime(ctx):
+    database.add_anime('Benchmark Anime', 12, 'Completed')
+    return ctx.marks()['anime']
+
+def new_genre(ctx):
+    database.add_genre('Benchmark Genre')
+    return ctx.marks()['genre']
+
+def new_preference(ctx):
+    user_id = ctx.user_id()
+    database.add_preference(user_id, 'benchmark', 'before')
+    return user_id
+
+def anime_batch(ctx, size=1000):
+    return [(f'Benchmark {ctx.word()} {n}', 12, 'Completed') for n in range(size)]
+
+def review_batch(ctx, size=1000):
+    pairs = set()
+    while len(pairs) < size:
+        pairs.add(ctx.unreviewed(pairs))
+    return [(user_id, anime_id, ctx.rng.randint(1, 10), None) for user_id, anime_id in sorted(pairs)]
+
+BENCHMARKS = [
+    Benchmark('schema_version', database.schema_version, lambda ctx: ()),
+    Benchmark('has_search_index', database.has_search_index, lambda ctx: ()),
+    Benchmark('get_anime_by_id', database.get_anime_by_id, lambda ctx: (ctx.anime_id(),)),
+    Benchmark('get_anime_page[id]', database.get_anime_page, lambda ctx: ('id',)),
+    Benchmark('get_anime_page[title]', database.get_anime_page, lambda ctx: ('title',)),
+    Benchmark('get_anime_page[rating desc]', database.get_anime_page,
+              lambda ctx: ('rating', None, database.PAGE_SIZE, True)),
+    Benchmark('get_anime_page[title next]', database.get_anime_page, lambda ctx: ('title', ctx.page_token('title'))),
+    Benchmark('search_anime', database.search_anime, lambda ctx: (ctx.word(),)),
+    Benchmark('search_anime_by_title', database.search_anime_by_title, lambda ctx: (ctx.word(),)),
+    Benchmark('search_reviews', database.search_reviews, lambda ctx: (ctx.rng.choice(['great', 'ending', 'slow']),)),
+    Benchmark('filter_anime_by_genre', database.filter_anime_by_genre, lambda ctx: (ctx.genre_id(),), heavy=True),
+    Benchmark('search_anime_by_genres', database.search_anime_by_genres,
+              lambda ctx: ([ctx.genre_id(), ctx.genre_id()],), heavy=True),
+    Benchmark('filter_anime_by_status', database.filter_anime_by_status, lambda ctx: (ctx.status(),), heavy=True),
+    Benchmark('filter_anime_by_statuses', database.filter_anime_by_statuses,
+              lambda ctx: ([ctx.status(), ctx.status()],), heavy=True),
+    Benchmark('get_all_anime', database.get_all_anime, lambda ctx: (), heavy=True),
+    Benchmark('get_reviews_for_anime', database.get_reviews_for_anime, lambda ctx: (ctx.anime_id(),)),
+    Benchmark('get_user_reviews', database.get_user_reviews, lambda ctx: (ctx.user_id(),)),
+    Benchmark('get_rating_summary', database.get_rating_summary, lambda ctx: (ctx.anime_id(),)),
+    Benchmark('get_global_rating_summary', database.get_global_rating_summary, lambda ctx: ()),
+    Benchmark('get_most_reviewed_anime', database.get_most_reviewed_anime, lambda ctx: ()),
+    Benchmark('get_catalog_totals', database.get_catalog_totals, lambda ctx: ()),
+    Benchmark('get_catalog_summary', database.get_catalog_summary, lambda ctx: ()),
+    Benchmark('get_top_rated', database.get_top_rated, lambda ctx: ()),
+    Benchmark('get_top_rated[genre]', database.get_top_rated,
+              lambda ctx: (database.TOP_RATED_LIMIT, ctx.genre_id())),
+    Benchmark('get_top_rated[status]', database.get_top_rated,
+              lambda ctx: (database.TOP_RATED_LIMIT, None, ctx.status())),
+    Benchmark('ranking_drift', database.ranking_drift, lambda ctx: ()),
+    Benchmark('get_preferences', database.get_preferences, lambda ctx: (ctx.user_id(),)),
+    Benchmark('get_all_genres', database.get_all_genres, lambda ctx: ()),
+    Benchmark('list_backups', database.list_backups, lambda ctx: ()),
+    Benchmark('add_review', database.add_review,
+              lambda ctx: (*ctx.unreviewed(), ctx.rng.randint(1, 10), 'benchmark review'), remove_rows_after),
+    Benchmark('upsert_review', database.upsert_review,
+              lambda ctx: (*ctx.unreviewed(), ctx.rng.randint(1, 10), 'benchmark review'), remove_rows_after),
+    Benchmark('upsert_review[existing]', database.upsert_review,
+              lambda ctx: (*reviewed_pair(ctx), 7, 'updated review'), remove_rows_after),
+    Benchmark('update_review', database.update_review, lambda ctx: (new_review(ctx), 7, 'updated review'),
+              remove_rows_after),
+    Benchmark('delete_review', database.delete_review, lambda ctx: (new_review(ctx),), remove_rows_after),
+    Benchmark('add_anime', database.add_anime, lambda ctx: (f'Benchmark {ctx.word()}', 12, 'Completed'),
+              remove_rows_after),
+    Benchmark('update_anime', database.update_anime,
+              lambda ctx: (new_anime(ctx), f'Benchmark {ctx.word()} Renamed', 24, 'Ongoing'), remove_rows_after),
+    Benchmark('delete_anime', database.delete_anime, lambda ctx: (new_anime(ctx),), remove_rows_after),
+    Benchmark('add_genre', database.add_genre, lambda ctx: ('Benchmark Genre',), remove_rows_after),
+    Benchmark('update_genre', database.update_genre, lambda ctx: (new_genre(ctx), 'Renamed Genre'),
+              remove_rows_after),
+    Benchmark('delete_genre', database.delete_genre, lambda ctx: (new_genre(ctx),), remove_rows_after),
+    Benchmark('add_preference', database.add_preference, lambda ctx: (ctx.user_id(), 'benchmark', 'value'),
+              remove_preference),
+    Benchmark('update_preference', database.update_preference,
+              lambda ctx: (new_preference(ctx), 'benchmark', 'after'), remove_preference),
+    Benchmark('set_preferences', database.set_preferences,
+              lambda ctx: (new_preference(ctx), {'benchmark': 'after', 'benchmark_extra': 'value'}),
+              remove_preferences),
+    Benchmark('delete_preference', database.delete_preference, lambda ctx: (new_preference(ctx), 'benchmark'),
+              remove_preference),
+    Benchmark('add_anime_many', database.add_anime_many, lambda ctx: (anime_batch(ctx),), remove_rows_after,
+              heavy=True),
+    Benchmark('add_reviews_many', database.add_reviews_many, lambda ctx: (review_batch(ctx),), remove_rows_after,
+              heavy=True),
+    Benchmark('upsert_reviews', database.upsert_reviews, lambda ctx: (review_batch(ctx),), remove_rows_after,
+              heavy=True),
+    Benchmark('export_table', database.export_table,
+              lambda ctx: ('anime', os.path.join(ctx.tmpdir, 'anime.csv')), heavy=True),
+    Benchmark('backup_database', database.backup_database, lambda ctx: (), heavy=True),
+    Benchmark('refresh_rankings', database.refresh_rankings, lambda ctx: (), heavy=True),
+    Benchmark('rebuild_rating_summary', database.rebuild_rating_summary, lambda ctx: (), heavy=True),
+    Benchmark('rebuild_search_index', database.rebuild_search_index, lambda ctx: (), heavy=True),
+    Benchmark('rebuild_trigram_index', database.rebuild_trigram_index, lambda ctx: (), heavy=True),
+]
+
+def uncovered():
+    # Public database.py functions with neither a benchmark nor a reason to
+    # skip them, so new ones do not go unmeasured by accident.
+    covered = {benchmark.name.split('[')[0] for benchmark in BENCHMARKS} | set(SKIPPED)
+    names = []
+    for name, func in inspect.getmembers(database, inspect.isfunction):
+        if name.startswith('_') or func.__module__ != database.__name__ or name.startswith('migration_'):
+            continue
+        parameters = list(inspect.signature(func).parameters)
+        # Helpers that run inside a caller's transaction are measured
+        # through their callers.
+        if parameters and parameters[0] == 'conn':
+            continue
+        if name not in covered:
+            names.append(name)
+    return names
+
+def percentile(samples, percent):
+    # Nearest-rank percentile of a sorted list.
+    index = max(0, -(-len(samples) * percent // 100) - 1)
+    return samples[index]
+
+def summarize(samples):
+    samples = sorted(samples)
+    summary = {'n': len(samples), 'mean': sum(samples) / len(samples), 'min': samples[0], 'max': samples[-1]}
+    for percent in PERCENTILES:
+        summary[f'p{percent}'] = percentile(samples, percent)
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in summary.items()}
+
+def call(benchmark, args):
+    started = time.perf_counter()
+    benchmark.func(*args)
+    return (time.perf_counter() - started) * 1000
+
+def measure(benchmark, ctx, iterations, cold):
+    # Cold iterations start from a fresh connection (empty SQLite page
+    # cache) and empty read-through caches; warm ones run after one untimed
+    # call with both left populated. The OS page cache is never dropped.
+    samples = []
+    for iteration in range(iterations + (0 if cold else 1)):
+        marks = ctx.marks() if benchmark.cleanup else None
+        args = benchmark.args(ctx)
+        if cold:
+            database.shutdown()
+            cache.clear()
+        elapsed = call(benchmark, args)
+        if cold or iteration:
+            samples.append(elapsed)
+        if benchmark.cleanup:
+            benchmark.cleanup(marks, args)
+    return summarize(samples)
+
+def environment(path):
+    conn = database.create_connection()
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+              for table in ('anime', 'genre', 'users', 'reviews', 'preferences')}
+    return {
+        'database': os.path.abspath(path),
+        'size_bytes': os.path.getsize(path),
+        'rows': counts,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+    }
+
+def copy_database(path, target):
+    # The backup API copies committed pages still sitting in the -wal file,
+    # which copying the main file alone would lose.
+    source = sqlite3.connect(path)
+    try:
+        destination = sqlite3.connect(target)
+        try:
+            source.backup(destination)
+        finally:
+            destination.close()
+    finally:
+        source.close()
+
+def run(path, out, iterations=ITERATIONS, seed=0, only=None, heavy=False, copy=True):
+    # Times every selected benchmark against a copy of path (writes are
+    # undone, but backups and rebuilds still touch the file) and writes the
+    # results as JSON to out.
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    workdir = tempfile.mkdtemp(prefix='anime-bench-db-') if copy else None
+    target = path
+    if copy:
+        target = os.path.join(workdir, os.path.basename(path))
+        copy_database(path, target)
+    database.configure(path=target)
+    database.create_table()
+    ctx = Context(seed)
+    results = {}
+    try:
+        meta = environment(target)
+        meta.update(source=os.path.abspath(path), iterations=iterations, seed=seed, heavy=heavy)
+        for benchmark in BENCHMARKS:
+            if only and not any(name in benchmark.name for name in only):
+                continue
+            if benchmark.heavy and not heavy:
+                continue
+            count = min(iterations, HEAVY_ITERATIONS) if benchmark.heavy else iterations
+            results[benchmark.name] = {
+                'cold': measure(benchmark, ctx, count, cold=True),
+                'warm': measure(benchmark, ctx, count, cold=False),
+            }
+            warm = results[benchmark.name]['warm']
+            print(f"{benchmark.name:<32} warm p50 {warm['p50']:>10.3f} ms  p99 {warm['p99']:>10.3f} ms")
+    finally:
+        database.shutdown()
+        shutil.rmtree(ctx.tmpdir, ignore_errors=True)
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = {'meta': meta, 'results': results, 'skipped': SKIPPED, 'uncovered': uncovered()}
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return report
+
+def compare(before, after, threshold=REGRESSION_THRESHOLD, min_delta=MIN_DELTA_MS):
+    # Yields (name, mode, stat, old, new, ratio, regressed) for every
+    # benchmark and mode the two runs have in common.
+    for name in sorted(set(before['results']) & set(after['results'])):
+        for mode in ('cold', 'warm'):
+            for stat in ('p50', 'p95'):
+                old = before['results'][name][mode][stat]
+                new = after['results'][name][mode][stat]
+                ratio = new / old if old else float('inf') if new else 1.0
+                regressed = ratio > 1 + threshold and new - old > min_delta
+                yield name, mode, stat, old, new, ratio, regressed
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the anime list database layer')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='time database.py functions and write JSON results')
+    run_parser.add_argument('--db', required=True, help='database to benchmark, e.g. from benchmarks.generate')
+    run_parser.add_argument('--out', required=True, help='JSON file to write')
+    run_parser.add_argument('--iterations', type=int, default=ITERATIONS)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--only', nargs='*', help='run benchmarks whose name contains any of these')
+    run_parser.add_argument('--heavy', action='store_true', help='include full scans, bulk loads and rebuilds')
+    run_parser.add_argument('--in-place', action='store_true', help='benchmark the file itself instead of a copy')
+    compare_parser = commands.add_parser('compare', help='flag regressions between two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                                help='relative slowdown to flag (default: %(default)s)')
+    compare_parser.add_argument('--min-delta', type=float, default=MIN_DELTA_MS,
+                                help='ignore slowdowns smaller than this many ms (default: %(default)s)')
+    compare_parser.add_argument('--all', action='store_true', help='print every comparison, not just regressions')
+    args = parser.parse_args()
+    if args.command == 'run':
+        report = run(args.db, args.out, args.iterations, args.seed, args.only, args.heavy, not args.in_place)
+        if report['uncovered']:
+            print(f"Not benchmarked: {', '.join(report['uncovered'])}")
+        print(f"Wrote {len(report['results'])} results to {args.out}")
+        return
+    regressions = 0
+    for name, mode, stat, old, new, ratio, regressed in compare(load(args.before), load(args.after),
+                                                                 args.threshold, args.min_delta):
+        regressions += regressed
+        if regressed or args.all:
+            flag = 'REGRESSION' if regressed else ''
+            print(f"{name:<32} {mode:<5} {stat:<4} {old:>10.3f} -> {new:>10.3f} ms  x{ratio:<6.2f} {flag}")
+    print(f"{regressions} regression(s) over {args.threshold:.0%}.")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
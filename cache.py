@@ -0,0 +1,118 @@
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 1024
+DEFAULT_TTL = 300
+
+ENABLED = True
+CACHES = {}
+
+class LRUCache:
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped by every invalidation so a lookup that started before a
+        # write cannot store the value it read after the write landed.
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key, value, version):
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.version += 1
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+            }
+
+def copy_result(value):
+    return list(value) if isinstance(value, list) else value
+
+def cached(maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+    def decorator(func):
+        store = LRUCache(maxsize, ttl)
+        CACHES[func.__name__] = store
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            key = args
+            if kwargs:
+                # Keyword calls share the positional key, which is also what
+                # invalidate() is given.
+                bound = signature.bind(*args, **kwargs)
+                key = bound.args + tuple(sorted(bound.kwargs.items()))
+            hit, value = store.get(key)
+            if hit:
+                return copy_result(value)
+            version = store.version
+            value = func(*args, **kwargs)
+            # Missing rows are not cached; the id may be inserted later.
+            if value is not None:
+                store.set(key, copy_result(value), version)
+            return value
+
+        wrapper.cache = store
+        return wrapper
+    return decorator
+
+def invalidate(name, *args):
+    CACHES[name].invalidate(args)
+
+def clear(name=None):
+    for cache_name, store in CACHES.items():
+        if name is None or cache_name == name:
+            store.clear()
+
+def set_enabled(enabled):
+    global ENABLED
+    ENABLED = enabled
+    clear()
+
+def stats():
+    return {name: store.stats() for name, store in CACHES.items()}
@@ -1,87 +1,1134 @@
 import sqlite3
+import argparse
 import csv
+import glob
+import gzip
+import json
+import os
+import re
 import shutil
+import threading
+import atexit
+import weakref
+import base64
+import time
+from collections import namedtuple
+from contextlib import contextmanager
 from datetime import datetime
 
+import cache
+
+DB_PATH = 'anime_list.db'
+STATEMENT_CACHE_SIZE = 256
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+# One long-lived connection per thread. Every connection handed out is also
+# tracked here so shutdown() can close connections owned by other threads.
+# The thread-local owner closes it and drops it from the list when the thread
+# exits, so worker threads do not leave connections and page caches behind.
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_generation = 0
+# Installed on every new connection while instrumentation.enable() is on.
+TRACE_CALLBACK = None
+# The first connection to DB_PATH brings its schema up to date, so callers
+# never need to run create_table() before querying a fresh file.
+_schema_lock = threading.RLock()
+_schema_ready = False
+
+BULK_BATCH_SIZE = 5000
+# Applied only for the duration of a bulk load when fast=True.
+FAST_LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'cache_size': -64000,
+}
+
+# Bulk loads index new rows with one INSERT ... SELECT instead of letting the
+# per-row FTS trigger fire, which is more than ten times slower.
+BULK_FTS_TRIGGERS = {
+    'anime': ('anime_fts_ai', 'anime_fts', 'title'),
+    'reviews': ('reviews_fts_ai', 'reviews_fts', 'review'),
+}
+
+EXPORT_CHUNK_SIZE = 2000
+# Joined views that can be exported by name alongside the plain tables.
+EXPORT_VIEWS = {
+    'review_details': '''
+        SELECT reviews.id, users.username, anime.title, reviews.rating, reviews.review
+        FROM reviews
+        JOIN users ON reviews.user_id = users.id
+        JOIN anime ON reviews.anime_id = anime.id
+    ''',
+    'anime_details': '''
+        SELECT anime.id, anime.title, anime.episodes, anime.status, anime.rating,
+               (SELECT group_concat(genre.name, ', ')
+                FROM anime_genre JOIN genre ON genre.id = anime_genre.genre_id
+                WHERE anime_genre.anime_id = anime.id) AS genres
+        FROM anime
+    ''',
+    'anime_genres': '''
+        SELECT anime.id, anime.title, genre.name AS genre
+        FROM anime_genre
+        JOIN anime ON anime_genre.anime_id = anime.id
+        JOIN genre ON anime_genre.genre_id = genre.id
+    ''',
+}
+
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_KEEP = 10
+
+PAGE_SIZE = 20
+# Sort keys for keyset pagination; rowid breaks ties so the order is total.
+PAGE_ORDERS = ('id', 'title', 'rating')
+
+# Read-through caches to drop when a bulk operation rewrites a table.
+TABLE_CACHES = {
+    'anime': ('get_anime_by_id',),
+    'genre': ('get_all_genres',),
+    'preferences': ('get_preferences',),
+    'reviews': ('get_reviews_for_anime',),
+}
+
+# Bayesian ranking: every anime is scored as if it also had this many reviews
+# at the catalog-wide mean, so a single 10/10 cannot top the chart.
+RANKING_PRIOR_WEIGHT = 10
+RANKING_DEFAULT_MEAN = 5.5
+TOP_RATED_LIMIT = 50
+
+# Change-log entries kept for in-memory genre indexes to catch up from.
+GENRE_LOG_KEEP = 10000
+# Same for cached trigram posting lists. Writes indexing more titles than
+# TRIGRAM_LOG_MAX_ROWS (bulk loads) skip the log and start a new generation.
+TRIGRAM_LOG_KEEP = 10000
+TRIGRAM_LOG_MAX_ROWS = 100
+
+LoadStats = namedtuple('LoadStats', ['rows', 'seconds', 'rows_per_second'])
+
+def configure(path=None, pragmas=None, cached_statements=None):
+    global DB_PATH, STATEMENT_CACHE_SIZE, _schema_ready
+    shutdown()
+    if path is not None:
+        DB_PATH = path
+        _schema_ready = False
+    if pragmas is not None:
+        PRAGMAS.update(pragmas)
+    if cached_statements is not None:
+        STATEMENT_CACHE_SIZE = cached_statements
+    cache.clear()
+
+def apply_pragmas(conn, pragmas=None):
+    for name, value in (pragmas or PRAGMAS).items():
+        conn.execute(f'PRAGMA {name} = {value}')
+
+def open_connection(path=None):
+    conn = sqlite3.connect(path or DB_PATH, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+    apply_pragmas(conn)
+    if TRACE_CALLBACK is not None:
+        conn.set_trace_callback(TRACE_CALLBACK)
+    return conn
+
+class _ConnectionOwner:
+    pass
+
+def release_connection(conn):
+    with _connections_lock:
+        if conn in _connections:
+            _connections.remove(conn)
+    conn.close()
+
 def create_connection():
-    return sqlite3.connect('anime_list.db')
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.generation == _generation:
+        return conn
+    conn = open_connection()
+    with _connections_lock:
+        _connections.append(conn)
+    # Only the thread-local holds the owner: it is collected with the thread's
+    # locals, or replaced below when shutdown() has bumped the generation.
+    owner = _ConnectionOwner()
+    weakref.finalize(owner, release_connection, conn)
+    _local.owner = owner
+    _local.conn = conn
+    _local.generation = _generation
+    if not _schema_ready:
+        ensure_schema()
+    return conn
 
-def create_table():
+def ensure_schema():
+    global _schema_ready
+    with _schema_lock:
+        # migrate() asks for this thread's connection again; other threads
+        # wait on the lock until the schema is in place.
+        if _schema_ready or getattr(_local, 'migrating', False):
+            return
+        _local.migrating = True
+        try:
+            migrate()
+        finally:
+            _local.migrating = False
+        _schema_ready = True
+
+def open_connections():
+    with _connections_lock:
+        return list(_connections)
+
+def close_connection():
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    _local.owner = None
+    if conn is None:
+        return
+    release_connection(conn)
+
+def shutdown():
+    global _generation
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+        _generation += 1
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            pass
+    _local.conn = None
+    _local.owner = None
+
+atexit.register(shutdown)
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def fts5_supported(conn=None):
+    conn = conn or create_connection()
+    options = [row[0] for row in conn.execute('PRAGMA compile_options')]
+    return 'ENABLE_FTS5' in options
+
+def has_search_index():
     conn = create_connection()
-    with conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL UNIQUE,
-                password TEXT NOT NULL
-            )
-        ''')
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS anime (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                episodes INTEGER NOT NULL,
-                status TEXT NOT NULL
-            )
-        ''')
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS genre (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL
-            )
-        ''')
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS anime_genre (
-                anime_id INTEGER,
-                genre_id INTEGER,
-                FOREIGN KEY (anime_id) REFERENCES anime (id),
-                FOREIGN KEY (genre_id) REFERENCES genre (id),
-                PRIMARY KEY (anime_id, genre_id)
-            )
-        ''')
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'anime_fts'")
+    return cursor.fetchone() is not None
+
+def migration_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anime (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            episodes INTEGER NOT NULL,
+            status TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS genre (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anime_genre (
+            anime_id INTEGER,
+            genre_id INTEGER,
+            FOREIGN KEY (anime_id) REFERENCES anime (id),
+            FOREIGN KEY (genre_id) REFERENCES genre (id),
+            PRIMARY KEY (anime_id, genre_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS preferences (
+            user_id INTEGER,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            PRIMARY KEY (user_id, key)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            anime_id INTEGER,
+            rating INTEGER CHECK (rating BETWEEN 1 AND 10),
+            review TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (anime_id) REFERENCES anime (id)
+        )
+    ''')
+
+def create_anime_search_triggers(conn):
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS anime_fts_ai AFTER INSERT ON anime BEGIN
+            INSERT INTO anime_fts (rowid, title) VALUES (new.rowid, new.title);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS anime_fts_ad AFTER DELETE ON anime BEGIN
+            INSERT INTO anime_fts (anime_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS anime_fts_au AFTER UPDATE OF title ON anime BEGIN
+            INSERT INTO anime_fts (anime_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+            INSERT INTO anime_fts (rowid, title) VALUES (new.rowid, new.title);
+        END
+    ''')
+
+def migration_search_index(conn):
+    if not fts5_supported(conn):
+        return
+    # External-content tables: the text lives only in anime/reviews and
+    # the triggers below keep the inverted index in step with it.
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS anime_fts
+        USING fts5(title, content='anime', tokenize='unicode61 remove_diacritics 2')
+    ''')
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts
+        USING fts5(review, content='reviews', tokenize='unicode61 remove_diacritics 2')
+    ''')
+    create_anime_search_triggers(conn)
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_ai AFTER INSERT ON reviews BEGIN
+            INSERT INTO reviews_fts (rowid, review) VALUES (new.id, new.review);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_ad AFTER DELETE ON reviews BEGIN
+            INSERT INTO reviews_fts (reviews_fts, rowid, review) VALUES ('delete', old.id, old.review);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_au AFTER UPDATE OF review ON reviews BEGIN
+            INSERT INTO reviews_fts (reviews_fts, rowid, review) VALUES ('delete', old.id, old.review);
+            INSERT INTO reviews_fts (rowid, review) VALUES (new.id, new.review);
+        END
+    ''')
+    conn.execute("INSERT INTO anime_fts (anime_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO reviews_fts (reviews_fts) VALUES ('rebuild')")
+
+def migration_lookup_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_reviews_anime_id ON reviews (anime_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_reviews_user_id ON reviews (user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_anime_genre_genre_id ON anime_genre (genre_id, anime_id)')
+    # Databases written by the GUI have an anime table without a status column.
+    if 'status' in table_columns(conn, 'anime'):
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_anime_status ON anime (status)')
+
+def migration_page_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_anime_title ON anime (title)')
+    if 'rating' in table_columns(conn, 'anime'):
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_anime_rating ON anime (rating)')
+
+RATINGS = range(1, 11)
+HISTOGRAM_COLUMNS = ', '.join(f'r{rating}' for rating in RATINGS)
+
+def histogram_delta(ref, sign):
+    return ', '.join(f'r{rating} = r{rating} {sign} ({ref}.rating = {rating})' for rating in RATINGS)
+
+def summary_delta(ref, sign):
+    return (f'review_count = review_count {sign} 1, rating_sum = rating_sum {sign} {ref}.rating, '
+            + histogram_delta(ref, sign))
+
+def create_catalog_triggers(conn):
+    # anime.rating only exists in the GUI's schema; elsewhere just count rows.
+    if 'rating' in table_columns(conn, 'anime'):
+        added = ('rated_count = rated_count + (new.rating IS NOT NULL), '
+                 'rating_sum = rating_sum + IFNULL(CAST(new.rating AS REAL), 0)')
+        removed = ('rated_count = rated_count - (old.rating IS NOT NULL), '
+                   'rating_sum = rating_sum - IFNULL(CAST(old.rating AS REAL), 0)')
+        # One assignment per column: SQLite keeps only the last of several.
         conn.execute('''
-            CREATE TABLE IF NOT EXISTS preferences (
-                user_id INTEGER,
-                key TEXT NOT NULL,
-                value TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                PRIMARY KEY (user_id, key)
-            )
+            CREATE TRIGGER IF NOT EXISTS anime_summary_au AFTER UPDATE OF rating ON anime BEGIN
+                UPDATE catalog_summary
+                SET rated_count = rated_count - (old.rating IS NOT NULL) + (new.rating IS NOT NULL),
+                    rating_sum = rating_sum - IFNULL(CAST(old.rating AS REAL), 0)
+                                            + IFNULL(CAST(new.rating AS REAL), 0)
+                WHERE id = 1;
+            END
         ''')
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS reviews (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                anime_id INTEGER,
-                rating INTEGER CHECK (rating BETWEEN 1 AND 10),
-                review TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (anime_id) REFERENCES anime (id)
-            )
+    else:
+        added = removed = 'rated_count = rated_count'
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS anime_summary_ai AFTER INSERT ON anime BEGIN
+            UPDATE catalog_summary SET anime_count = anime_count + 1, {added} WHERE id = 1;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS anime_summary_ad AFTER DELETE ON anime BEGIN
+            UPDATE catalog_summary SET anime_count = anime_count - 1, {removed} WHERE id = 1;
+        END
+    ''')
+
+def fill_rating_summary(conn):
+    sums = ', '.join(f'SUM(rating = {rating})' for rating in RATINGS)
+    conn.execute('DELETE FROM anime_rating_summary')
+    conn.execute(f'''
+        INSERT INTO anime_rating_summary (anime_id, review_count, rating_sum, {HISTOGRAM_COLUMNS})
+        SELECT anime_id, COUNT(*), SUM(rating), {sums}
+        FROM reviews
+        WHERE rating IS NOT NULL
+        GROUP BY anime_id
+    ''')
+    conn.execute('DELETE FROM rating_summary')
+    conn.execute(f'''
+        INSERT INTO rating_summary (id, review_count, rating_sum, {HISTOGRAM_COLUMNS})
+        SELECT 1, COUNT(*), IFNULL(SUM(rating), 0), {', '.join(f'IFNULL(SUM(rating = {rating}), 0)' for rating in RATINGS)}
+        FROM reviews
+        WHERE rating IS NOT NULL
+    ''')
+    rating = 'CAST(rating AS REAL)' if 'rating' in table_columns(conn, 'anime') else 'NULL'
+    conn.execute('DELETE FROM catalog_summary')
+    conn.execute(f'''
+        INSERT INTO catalog_summary (id, anime_count, rated_count, rating_sum)
+        SELECT 1, COUNT(*), COUNT({rating}), IFNULL(SUM({rating}), 0)
+        FROM anime
+    ''')
+
+def migration_rating_summary(conn):
+    histogram = ', '.join(f'r{rating} INTEGER NOT NULL DEFAULT 0' for rating in RATINGS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS anime_rating_summary (
+            anime_id INTEGER PRIMARY KEY,
+            review_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            {histogram}
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_anime_rating_summary_count ON anime_rating_summary (review_count)')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS rating_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            review_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            {histogram}
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            anime_count INTEGER NOT NULL DEFAULT 0,
+            rated_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    create_review_summary_triggers(conn)
+    create_catalog_triggers(conn)
+    fill_rating_summary(conn)
+
+def summary_row(ref):
+    # Not INSERT OR IGNORE: the conflict handling of an upsert overrides the
+    # OR clause of every statement in the triggers it fires.
+    return (f'INSERT INTO anime_rating_summary (anime_id) SELECT {ref}.anime_id WHERE {ref}.rating IS NOT NULL '
+            f'AND NOT EXISTS (SELECT 1 FROM anime_rating_summary WHERE anime_id = {ref}.anime_id);')
+
+def create_review_summary_triggers(conn):
+    # Reviews without a rating are kept out of every aggregate.
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reviews_summary_ai AFTER INSERT ON reviews BEGIN
+            {summary_row('new')}
+            UPDATE anime_rating_summary SET {summary_delta('new', '+')}
+            WHERE anime_id = new.anime_id AND new.rating IS NOT NULL;
+            UPDATE rating_summary SET {summary_delta('new', '+')} WHERE id = 1 AND new.rating IS NOT NULL;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reviews_summary_ad AFTER DELETE ON reviews BEGIN
+            UPDATE anime_rating_summary SET {summary_delta('old', '-')}
+            WHERE anime_id = old.anime_id AND old.rating IS NOT NULL;
+            UPDATE rating_summary SET {summary_delta('old', '-')} WHERE id = 1 AND old.rating IS NOT NULL;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reviews_summary_au AFTER UPDATE OF rating, anime_id ON reviews BEGIN
+            UPDATE anime_rating_summary SET {summary_delta('old', '-')}
+            WHERE anime_id = old.anime_id AND old.rating IS NOT NULL;
+            UPDATE rating_summary SET {summary_delta('old', '-')} WHERE id = 1 AND old.rating IS NOT NULL;
+            {summary_row('new')}
+            UPDATE anime_rating_summary SET {summary_delta('new', '+')}
+            WHERE anime_id = new.anime_id AND new.rating IS NOT NULL;
+            UPDATE rating_summary SET {summary_delta('new', '+')} WHERE id = 1 AND new.rating IS NOT NULL;
+        END
+    ''')
+
+def migration_rankings(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ranking_prior (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            mean REAL NOT NULL,
+            weight REAL NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anime_ranking (
+            anime_id INTEGER PRIMARY KEY,
+            score REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_anime_ranking_score ON anime_ranking (score)')
+    # Rescore one anime whenever its rating summary moves. Scores use the
+    # stored prior so they stay comparable until the next full refresh.
+    score = ('(ranking_prior.weight * ranking_prior.mean + new.rating_sum) '
+             '/ (ranking_prior.weight + new.review_count)')
+    for event in ('INSERT', 'UPDATE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS anime_ranking_{event.lower()} AFTER {event} ON anime_rating_summary BEGIN
+                DELETE FROM anime_ranking WHERE anime_id = new.anime_id AND new.review_count = 0;
+                INSERT INTO anime_ranking (anime_id, score)
+                SELECT new.anime_id, {score} FROM ranking_prior WHERE id = 1 AND new.review_count > 0
+                ON CONFLICT (anime_id) DO UPDATE SET score = excluded.score;
+            END
         ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS anime_ranking_delete AFTER DELETE ON anime_rating_summary BEGIN
+            DELETE FROM anime_ranking WHERE anime_id = old.anime_id;
+        END
+    ''')
+    fill_rankings(conn)
+
+def fill_rankings(conn, weight=RANKING_PRIOR_WEIGHT):
+    count, total = conn.execute('SELECT review_count, rating_sum FROM rating_summary WHERE id = 1').fetchone()
+    mean = total / count if count else RANKING_DEFAULT_MEAN
+    conn.execute('INSERT OR REPLACE INTO ranking_prior (id, mean, weight) VALUES (1, ?, ?)', (mean, weight))
+    conn.execute('DELETE FROM anime_ranking')
+    conn.execute('''
+        INSERT INTO anime_ranking (anime_id, score)
+        SELECT anime_id, (? * ? + rating_sum) / (? + review_count)
+        FROM anime_rating_summary
+        WHERE review_count > 0
+    ''', (weight, mean, weight))
+
+def migration_genre_log(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anime_genre_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            anime_id INTEGER NOT NULL,
+            genre_id INTEGER NOT NULL,
+            added INTEGER NOT NULL
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS anime_genre_log_ai AFTER INSERT ON anime_genre BEGIN
+            INSERT INTO anime_genre_log (anime_id, genre_id, added) VALUES (new.anime_id, new.genre_id, 1);
+            DELETE FROM anime_genre_log WHERE seq <= (SELECT MAX(seq) FROM anime_genre_log) - {GENRE_LOG_KEEP};
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS anime_genre_log_ad AFTER DELETE ON anime_genre BEGIN
+            INSERT INTO anime_genre_log (anime_id, genre_id, added) VALUES (old.anime_id, old.genre_id, 0);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS anime_genre_log_au AFTER UPDATE ON anime_genre BEGIN
+            INSERT INTO anime_genre_log (anime_id, genre_id, added) VALUES (old.anime_id, old.genre_id, 0);
+            INSERT INTO anime_genre_log (anime_id, genre_id, added) VALUES (new.anime_id, new.genre_id, 1);
+        END
+    ''')
+
+def migration_similarity(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anime_similarity (
+            anime_id INTEGER NOT NULL,
+            neighbor_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (anime_id, neighbor_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_anime_similarity_neighbor ON anime_similarity (neighbor_id)')
+    # Any rating change makes that anime's neighbor list stale. The version
+    # lets the recommender clear only entries that did not change again
+    # while it was recomputing them.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS similarity_dirty (
+            anime_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS similarity_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            computed_at TEXT
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO similarity_state (id, computed_at) VALUES (1, NULL)')
+    mark = '''
+        INSERT INTO similarity_dirty (anime_id) VALUES ({}.anime_id)
+        ON CONFLICT (anime_id) DO UPDATE SET version = version + 1;
+    '''
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reviews_similarity_ai AFTER INSERT ON reviews BEGIN
+            {mark.format('new')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reviews_similarity_ad AFTER DELETE ON reviews BEGIN
+            {mark.format('old')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reviews_similarity_au AFTER UPDATE OF rating, anime_id, user_id ON reviews BEGIN
+            {mark.format('old')}
+            {mark.format('new')}
+        END
+    ''')
+
+def title_trigrams(title):
+    # pg_trgm style: lower-case words, each padded with two leading spaces
+    # and one trailing space so word starts weigh more than word ends.
+    trigrams = set()
+    for word in re.findall(r'\w+', (title or '').lower()):
+        padded = f'  {word} '
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+def bump_trigram_version(conn):
+    # The index generation: readers that cache posting lists drop them all
+    # when it changes. Small writes log their postings instead, see below.
+    conn.execute('UPDATE trigram_index_state SET version = version + 1 WHERE id = 1')
+
+def log_postings(conn, postings, added):
+    # Lets cached posting lists catch up by applying the logged changes
+    # rather than reloading, as genre_index does with anime_genre_log.
+    conn.executemany('INSERT INTO anime_trigram_log (trigram, anime_id, added) VALUES (?, ?, ?)',
+                     ((trigram, anime_id, added) for trigram, anime_id in postings))
+    conn.execute('''
+        DELETE FROM anime_trigram_log
+        WHERE seq <= (SELECT MAX(seq) FROM anime_trigram_log) - ?
+    ''', (TRIGRAM_LOG_KEEP,))
+
+def index_titles(conn, rows):
+    postings = []
+    sizes = []
+    for anime_id, title in rows:
+        trigrams = title_trigrams(title)
+        postings.extend((trigram, anime_id) for trigram in trigrams)
+        sizes.append((anime_id, len(trigrams)))
+    conn.executemany('INSERT OR IGNORE INTO anime_trigram (trigram, anime_id) VALUES (?, ?)', postings)
+    conn.executemany('INSERT OR REPLACE INTO anime_trigram_size (anime_id, size) VALUES (?, ?)', sizes)
+    if len(rows) > TRIGRAM_LOG_MAX_ROWS:
+        bump_trigram_version(conn)
+    else:
+        log_postings(conn, postings, 1)
+
+def unindex_title(conn, anime_id):
+    postings = conn.execute('SELECT trigram, anime_id FROM anime_trigram WHERE anime_id = ?', (anime_id,)).fetchall()
+    conn.execute('DELETE FROM anime_trigram WHERE anime_id = ?', (anime_id,))
+    conn.execute('DELETE FROM anime_trigram_size WHERE anime_id = ?', (anime_id,))
+    log_postings(conn, postings, 0)
+
+def fill_trigram_index(conn):
+    conn.execute('DELETE FROM anime_trigram')
+    conn.execute('DELETE FROM anime_trigram_size')
+    conn.execute('DELETE FROM anime_trigram_log')
+    bump_trigram_version(conn)
+    cursor = conn.execute('SELECT rowid, title FROM anime')
+    while True:
+        rows = cursor.fetchmany(BULK_BATCH_SIZE)
+        if not rows:
+            break
+        index_titles(conn, rows)
+
+def migration_title_trigrams(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anime_trigram (
+            trigram TEXT NOT NULL,
+            anime_id INTEGER NOT NULL,
+            PRIMARY KEY (trigram, anime_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_anime_trigram_anime_id ON anime_trigram (anime_id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anime_trigram_size (
+            anime_id INTEGER PRIMARY KEY,
+            size INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS trigram_index_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO trigram_index_state (id, version) VALUES (1, 0)')
+    create_trigram_log(conn)
+    fill_trigram_index(conn)
+
+def create_trigram_log(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anime_trigram_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            trigram TEXT NOT NULL,
+            anime_id INTEGER NOT NULL,
+            added INTEGER NOT NULL
+        )
+    ''')
+
+ANIME_COLUMNS = ('id', 'title', 'episodes', 'status', 'rating')
+
+def parse_rating(value):
+    # Older files kept ratings as text; anything that is not a number from
+    # 0 to 10 becomes NULL.
+    try:
+        rating = float(value)
+    except (TypeError, ValueError):
+        return None
+    return rating if 0 <= rating <= 10 else None
+
+def split_genres(text):
+    return [name.strip() for name in (text or '').split(',') if name.strip()]
+
+def genre_ids(conn, names, known=None):
+    # Looks genres up by name, ignoring case, and creates the missing ones.
+    known = {} if known is None else known
+    ids = []
+    for name in names:
+        key = name.casefold()
+        if key not in known:
+            row = conn.execute('SELECT id FROM genre WHERE name = ? COLLATE NOCASE', (name,)).fetchone()
+            known[key] = row[0] if row else conn.execute('INSERT INTO genre (name) VALUES (?)', (name,)).lastrowid
+        ids.append(known[key])
+    return ids
+
+def migration_unified_anime(conn):
+    # The CLI, the GUI and the shipped anime_list.db each had their own anime
+    # table: (id, title, episodes, status), (id, title, genre, rating REAL)
+    # and (title, genre, rating TEXT). Rebuild whichever one this file has
+    # into the shared layout, keeping rowids so reviews and anime_genre still
+    # point at the same anime, and move the GUI's genre text into anime_genre.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_genre_name ON genre (name COLLATE NOCASE)')
+    columns = table_columns(conn, 'anime')
+    if tuple(columns) == ANIME_COLUMNS:
+        return
+    conn.execute('''
+        CREATE TABLE anime_unified (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            episodes INTEGER CHECK (episodes IS NULL OR episodes >= 0),
+            status TEXT,
+            rating REAL CHECK (rating IS NULL OR rating BETWEEN 0 AND 10)
+        )
+    ''')
+    select = ', '.join(column if column in columns else 'NULL' for column in ('episodes', 'status', 'rating', 'genre'))
+    rows = []
+    links = []
+    known = {}
+    for anime_id, title, episodes, status, rating, genre in conn.execute(
+            f'SELECT rowid, title, {select} FROM anime').fetchall():
+        rows.append((anime_id, title or '', episodes, status, parse_rating(rating)))
+        links.extend((anime_id, genre_id) for genre_id in genre_ids(conn, split_genres(genre), known))
+    conn.executemany('INSERT INTO anime_unified (id, title, episodes, status, rating) VALUES (?, ?, ?, ?, ?)', rows)
+    conn.executemany('INSERT OR IGNORE INTO anime_genre (anime_id, genre_id) VALUES (?, ?)', links)
+    # Dropping the old table also drops its indexes and triggers; put them back.
+    conn.execute('DROP TABLE anime')
+    conn.execute('ALTER TABLE anime_unified RENAME TO anime')
+    migration_lookup_indexes(conn)
+    migration_page_indexes(conn)
+    create_catalog_triggers(conn)
+    fill_rating_summary(conn)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'anime_fts'").fetchone():
+        create_anime_search_triggers(conn)
+        conn.execute("INSERT INTO anime_fts (anime_fts) VALUES ('rebuild')")
+    fill_trigram_index(conn)
+
+def migration_unique_reviews(conn):
+    # One review per user and anime. Duplicates used to pile up and count
+    # several times in every aggregate; keep each pair's newest review and
+    # delete the rest through the usual triggers so the summaries, search
+    # index and similarity queue follow.
+    conn.execute('''
+        DELETE FROM reviews
+        WHERE EXISTS (
+            SELECT 1 FROM reviews AS newer
+            WHERE newer.user_id = reviews.user_id
+              AND newer.anime_id = reviews.anime_id
+              AND newer.id > reviews.id
+        )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_reviews_user_anime ON reviews (user_id, anime_id)')
+    # The unique index starts with user_id and serves those lookups too.
+    conn.execute('DROP INDEX IF EXISTS idx_reviews_user_id')
+    # Older files have summary triggers that upserts cannot fire.
+    conn.execute('DROP TRIGGER IF EXISTS reviews_summary_ai')
+    conn.execute('DROP TRIGGER IF EXISTS reviews_summary_au')
+    create_review_summary_triggers(conn)
+
+def migration_catalog_summary_update(conn):
+    # anime_summary_au used to assign rated_count and rating_sum twice, so
+    # every rating edit dropped the old rating's share. Replace the trigger
+    # and recount the summaries it left behind.
+    conn.execute('DROP TRIGGER IF EXISTS anime_summary_au')
+    create_catalog_triggers(conn)
+    fill_rating_summary(conn)
+
+def migration_trigram_log(conn):
+    create_trigram_log(conn)
+    bump_trigram_version(conn)
+
+def migration_catalog_version(conn):
+    # Bumped by every change to anime, genres or their links, so readers that
+    # cache results derived from them (faceted_search's counts) can key on it.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)')
+    for table in ('anime', 'anime_genre', 'genre'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+def catalog_version(conn):
+    return conn.execute('SELECT version FROM catalog_version WHERE id = 1').fetchone()[0]
+
+# Applied in order; PRAGMA user_version records how many have run. Only ever
+# append to this list, and keep every step safe to re-run on an old file.
+MIGRATIONS = [
+    migration_base_tables,
+    migration_search_index,
+    migration_lookup_indexes,
+    migration_page_indexes,
+    migration_rating_summary,
+    migration_rankings,
+    migration_genre_log,
+    migration_similarity,
+    migration_title_trigrams,
+    migration_unified_anime,
+    migration_unique_reviews,
+    migration_catalog_summary_update,
+    migration_trigram_log,
+    migration_catalog_version,
+]
+
+def schema_version():
+    conn = create_connection()
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate():
+    conn = create_connection()
+    applied = []
+    for version, migration in enumerate(MIGRATIONS, 1):
+        if version <= schema_version():
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        with conn:
+            # Another process may have migrated while we waited for the lock.
+            if version <= schema_version():
+                continue
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+        applied.append(migration.__name__)
+    if applied:
+        conn.execute('ANALYZE')
+    return applied
+
+def create_table():
+    migrate()
+
+def rebuild_search_index():
+    conn = create_connection()
+    with conn:
+        conn.execute("INSERT INTO anime_fts (anime_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO reviews_fts (reviews_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO anime_fts (anime_fts) VALUES ('optimize')")
+        conn.execute("INSERT INTO reviews_fts (reviews_fts) VALUES ('optimize')")
+
+def rebuild_rating_summary():
+    conn = create_connection()
+    with conn:
+        fill_rating_summary(conn)
+
+def summarize_ratings(row):
+    if row is None:
+        return 0, None, None, None, [0] * len(RATINGS)
+    count, total, histogram = row[0], row[1], list(row[2:])
+    # Min and max come from the histogram, so deletes never force a rescan.
+    present = [rating for rating, n in zip(RATINGS, histogram) if n]
+    if not count:
+        return 0, None, None, None, histogram
+    return count, total / count, present[0], present[-1], histogram
+
+def get_rating_summary(anime_id):
+    conn = create_connection()
+    row = conn.execute(f'''
+        SELECT review_count, rating_sum, {HISTOGRAM_COLUMNS}
+        FROM anime_rating_summary
+        WHERE anime_id = ?
+    ''', (anime_id,)).fetchone()
+    return summarize_ratings(row)
+
+def get_global_rating_summary():
+    conn = create_connection()
+    row = conn.execute(f'SELECT review_count, rating_sum, {HISTOGRAM_COLUMNS} FROM rating_summary WHERE id = 1').fetchone()
+    return summarize_ratings(row)
+
+def get_most_reviewed_anime(limit=10):
+    conn = create_connection()
+    cursor = conn.execute('''
+        SELECT anime.*, anime_rating_summary.review_count,
+               CAST(anime_rating_summary.rating_sum AS REAL) / anime_rating_summary.review_count
+        FROM anime_rating_summary
+        JOIN anime ON anime.rowid = anime_rating_summary.anime_id
+        WHERE anime_rating_summary.review_count > 0
+        ORDER BY anime_rating_summary.review_count DESC
+        LIMIT ?
+    ''', (limit,))
+    return cursor.fetchall()
+
+def get_catalog_totals():
+    conn = create_connection()
+    count, rated, total = conn.execute(
+        'SELECT anime_count, rated_count, rating_sum FROM catalog_summary WHERE id = 1').fetchone()
+    highest = None
+    if 'rating' in table_columns(conn, 'anime'):
+        # Served from idx_anime_rating, so this is a single index probe.
+        highest = conn.execute('SELECT MAX(rating) FROM anime').fetchone()[0]
+    return count, rated, total, highest
+
+def get_catalog_summary():
+    count, rated, total, highest = get_catalog_totals()
+    return count, total / rated if rated else None, highest
+
+def refresh_rankings(weight=RANKING_PRIOR_WEIGHT):
+    conn = create_connection()
+    with conn:
+        fill_rankings(conn, weight)
+
+def ranking_drift():
+    conn = create_connection()
+    prior = conn.execute('SELECT mean FROM ranking_prior WHERE id = 1').fetchone()[0]
+    count, total = conn.execute('SELECT review_count, rating_sum FROM rating_summary WHERE id = 1').fetchone()
+    return abs((total / count if count else RANKING_DEFAULT_MEAN) - prior)
+
+def get_top_rated(limit=TOP_RATED_LIMIT, genre_id=None, status=None):
+    sql = '''
+        SELECT anime.rowid, anime.title, anime_ranking.score, anime_rating_summary.review_count,
+               CAST(anime_rating_summary.rating_sum AS REAL) / anime_rating_summary.review_count
+        FROM anime_ranking
+        JOIN anime ON anime.rowid = anime_ranking.anime_id
+        JOIN anime_rating_summary ON anime_rating_summary.anime_id = anime_ranking.anime_id
+    '''
+    params = []
+    if genre_id is not None:
+        sql += ' JOIN anime_genre ON anime_genre.anime_id = anime_ranking.anime_id AND anime_genre.genre_id = ?'
+        params.append(genre_id)
+    if status is not None:
+        sql += ' WHERE anime.status = ?'
+        params.append(status)
+    sql += ' ORDER BY anime_ranking.score DESC LIMIT ?'
+    params.append(limit)
+    conn = create_connection()
+    return conn.execute(sql, params).fetchall()
+
+def rebuild_trigram_index():
+    conn = create_connection()
+    with conn:
+        fill_trigram_index(conn)
+
+def build_match_query(text, prefix=True):
+    # Quote every word so user input can never be parsed as FTS5 syntax.
+    terms = re.findall(r'\w+', text)
+    return ' '.join('"{}"{}'.format(term, '*' if prefix else '') for term in terms)
+
+def search_anime(text, limit=20, prefix=True):
+    query = build_match_query(text, prefix)
+    if not query:
+        return []
+    conn = create_connection()
+    cursor = conn.execute('''
+        SELECT anime.rowid, highlight(anime_fts, 0, '[', ']'), bm25(anime_fts) AS score
+        FROM anime_fts
+        JOIN anime ON anime.rowid = anime_fts.rowid
+        WHERE anime_fts MATCH ?
+        ORDER BY score
+        LIMIT ?
+    ''', (query, limit))
+    return cursor.fetchall()
+
+def search_reviews(text, limit=20, prefix=True):
+    query = build_match_query(text, prefix)
+    if not query:
+        return []
+    conn = create_connection()
+    cursor = conn.execute('''
+        SELECT reviews.id, reviews.anime_id, reviews.user_id, reviews.rating,
+               snippet(reviews_fts, 0, '[', ']', '...', 12), bm25(reviews_fts) AS score
+        FROM reviews_fts
+        JOIN reviews ON reviews.id = reviews_fts.rowid
+        WHERE reviews_fts MATCH ?
+        ORDER BY score
+        LIMIT ?
+    ''', (query, limit))
+    return cursor.fetchall()
+
+def batched(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+@contextmanager
+def bulk_load(table, batch_size=BULK_BATCH_SIZE, fast=False, truncate=False):
+    # Yields a connection inside one transaction for loading many rows into
+    # table. Per-row index triggers are suspended meanwhile and the new rows
+    # are indexed in one pass before the transaction commits.
+    conn = create_connection()
+    saved = {}
+    if fast:
+        for name, value in FAST_LOAD_PRAGMAS.items():
+            saved[name] = conn.execute(f'PRAGMA {name}').fetchone()[0]
+        apply_pragmas(conn, FAST_LOAD_PRAGMAS)
+    try:
+        conn.execute('BEGIN')
+        with conn:
+            trigger_sql = None
+            if table in BULK_FTS_TRIGGERS:
+                trigger, fts_table, column = BULK_FTS_TRIGGERS[table]
+                row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (trigger,)).fetchone()
+                if row:
+                    trigger_sql = row[0]
+                    conn.execute(f'DROP TRIGGER {trigger}')
+            if truncate:
+                conn.execute(f'DELETE FROM {table}')
+                if table == 'anime':
+                    fill_trigram_index(conn)
+            last_rowid = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {table}').fetchone()[0]
+            yield conn
+            if trigger_sql:
+                conn.execute(f'''
+                    INSERT INTO {fts_table} (rowid, {column})
+                    SELECT rowid, {column} FROM {table} WHERE rowid > ?
+                ''', (last_rowid,))
+                conn.execute(trigger_sql)
+            if table == 'anime':
+                new_titles = conn.execute('SELECT rowid, title FROM anime WHERE rowid > ?', (last_rowid,))
+                while True:
+                    rows_added = new_titles.fetchmany(batch_size)
+                    if not rows_added:
+                        break
+                    index_titles(conn, rows_added)
+    finally:
+        if saved:
+            apply_pragmas(conn, saved)
+        for name in TABLE_CACHES.get(table, ()):
+            cache.clear(name)
+
+def insert_many(table, columns, rows, batch_size=BULK_BATCH_SIZE, fast=False, truncate=False):
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns), ', '.join('?' * len(columns)))
+    started = time.perf_counter()
+    count = 0
+    with bulk_load(table, batch_size, fast, truncate) as conn:
+        for batch in batched(rows, batch_size):
+            conn.executemany(sql, batch)
+            count += len(batch)
+    seconds = time.perf_counter() - started
+    return LoadStats(count, seconds, count / seconds if seconds else 0.0)
+
+def add_anime_many(rows, batch_size=BULK_BATCH_SIZE, fast=False):
+    return insert_many('anime', ('title', 'episodes', 'status'), rows, batch_size, fast)
+
+def add_reviews_many(rows, batch_size=BULK_BATCH_SIZE, fast=False):
+    return insert_many('reviews', ('user_id', 'anime_id', 'rating', 'review'), rows, batch_size, fast)
+
+def add_genres_many(names, batch_size=BULK_BATCH_SIZE, fast=False):
+    return insert_many('genre', ('name',), ((name,) for name in names), batch_size, fast)
+
+# The single-statement writes below are shared with write_queue, which runs
+# many of them in one transaction. Inserts return the new rowid, updates the
+# number of rows changed.
+def insert_review(conn, user_id, anime_id, rating, review):
+    return conn.execute('''
+        INSERT INTO reviews (user_id, anime_id, rating, review)
+        VALUES (?, ?, ?, ?)
+    ''', (user_id, anime_id, rating, review)).lastrowid
+
+def change_review(conn, review_id, rating, review):
+    return conn.execute('''
+        UPDATE reviews
+        SET rating = ?, review = ?
+        WHERE id = ?
+    ''', (rating, review, review_id)).rowcount
+
+UPSERT_REVIEW = '''
+    INSERT INTO reviews (user_id, anime_id, rating, review)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id, anime_id) DO UPDATE SET rating = excluded.rating, review = excluded.review
+'''
+
+def save_review(conn, user_id, anime_id, rating, review):
+    # Adds the review or replaces the user's existing one for that anime;
+    # either way returns its id.
+    return conn.execute(UPSERT_REVIEW + ' RETURNING id', (user_id, anime_id, rating, review)).fetchall()[0][0]
 
 def add_review(user_id, anime_id, rating, review):
     conn = create_connection()
     with conn:
-        conn.execute('''
-            INSERT INTO reviews (user_id, anime_id, rating, review)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, anime_id, rating, review))
+        review_id = insert_review(conn, user_id, anime_id, rating, review)
+    cache.invalidate('get_reviews_for_anime', anime_id)
+    return review_id
+
+def upsert_review(user_id, anime_id, rating, review):
+    conn = create_connection()
+    with conn:
+        review_id = save_review(conn, user_id, anime_id, rating, review)
+    cache.invalidate('get_reviews_for_anime', anime_id)
+    return review_id
+
+def upsert_reviews(rows, batch_size=BULK_BATCH_SIZE):
+    # rows of (user_id, anime_id, rating, review), all in one transaction.
+    # Returns how many rows were written.
+    conn = create_connection()
+    count = 0
+    touched = set()
+    with conn:
+        for batch in batched(rows, batch_size):
+            conn.executemany(UPSERT_REVIEW, batch)
+            count += len(batch)
+            touched.update(anime_id for _, anime_id, _, _ in batch)
+    for anime_id in touched:
+        cache.invalidate('get_reviews_for_anime', anime_id)
+    return count
+
+def review_anime_id(conn, review_id):
+    row = conn.execute('SELECT anime_id FROM reviews WHERE id = ?', (review_id,)).fetchone()
+    return row[0] if row else None
 
 def update_review(review_id, rating, review):
     conn = create_connection()
     with conn:
-        conn.execute('''
-            UPDATE reviews
-            SET rating = ?, review = ?
-            WHERE id = ?
-        ''', (rating, review, review_id))
+        anime_id = review_anime_id(conn, review_id)
+        changed = change_review(conn, review_id, rating, review)
+    cache.invalidate('get_reviews_for_anime', anime_id)
+    return changed
 
 def delete_review(review_id):
     conn = create_connection()
     with conn:
+        anime_id = review_anime_id(conn, review_id)
         conn.execute('DELETE FROM reviews WHERE id = ?', (review_id,))
+    cache.invalidate('get_reviews_for_anime', anime_id)
 
+@cache.cached()
 def get_reviews_for_anime(anime_id):
     conn = create_connection()
     with conn:
@@ -107,24 +1154,33 @@ def get_user_reviews(user_id):
 def add_anime(title, episodes, status):
     conn = create_connection()
     with conn:
-        conn.execute('''
+        cursor = conn.execute('''
             INSERT INTO anime (title, episodes, status)
             VALUES (?, ?, ?)
         ''', (title, episodes, status))
+        index_titles(conn, [(cursor.lastrowid, title)])
 
 def update_anime(anime_id, title, episodes, status):
     conn = create_connection()
     with conn:
-        conn.execute('''
+        cursor = conn.execute('''
             UPDATE anime
             SET title = ?, episodes = ?, status = ?
             WHERE id = ?
         ''', (title, episodes, status, anime_id))
+        # No such anime: leave the title index alone.
+        if cursor.rowcount:
+            unindex_title(conn, anime_id)
+            index_titles(conn, [(anime_id, title)])
+    cache.invalidate('get_anime_by_id', anime_id)
 
 def delete_anime(anime_id):
     conn = create_connection()
     with conn:
+        conn.execute('DELETE FROM anime_genre WHERE anime_id = ?', (anime_id,))
         conn.execute('DELETE FROM anime WHERE id = ?', (anime_id,))
+        unindex_title(conn, anime_id)
+    cache.invalidate('get_anime_by_id', anime_id)
 
 def get_all_anime():
     conn = create_connection()
@@ -132,6 +1188,54 @@ def get_all_anime():
         cursor = conn.execute('SELECT * FROM anime')
         return cursor.fetchall()
 
+def encode_page_token(order, descending, key, rowid):
+    data = json.dumps([order, descending, key, rowid]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+def decode_page_token(token, order, descending):
+    try:
+        token_order, token_descending, key, rowid = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid page token')
+    if token_order != order or token_descending != descending:
+        raise ValueError('Page token was issued for a different ordering')
+    return key, rowid
+
+def keyset_clause(column, value, last_id, descending=False, id_column='rowid'):
+    # Condition for the rows after (value, last_id) in ORDER BY column,
+    # id_column. SQLite sorts NULLs first and a row value comparison with
+    # NULL is never true, so those need spelling out.
+    if value is None:
+        if descending:
+            return f'{column} IS NULL AND {id_column} < ?', [last_id]
+        return f'({column} IS NOT NULL OR {id_column} > ?)', [last_id]
+    compare = '<' if descending else '>'
+    nulls = f' OR {column} IS NULL' if descending else ''
+    return f'(({column}, {id_column}) {compare} (?, ?){nulls})', [value, last_id]
+
+def get_anime_page(order='id', token=None, page_size=PAGE_SIZE, descending=False):
+    if order not in PAGE_ORDERS:
+        raise ValueError(f'Cannot order anime by {order}')
+    conn = create_connection()
+    key = 'rowid' if order == 'id' else order
+    if key not in ('rowid', *table_columns(conn, 'anime')):
+        raise ValueError(f'Cannot order anime by {order}')
+    direction = 'DESC' if descending else 'ASC'
+    sql = f'SELECT anime.*, {key}, rowid FROM anime'
+    params = []
+    if token:
+        clause, params = keyset_clause(key, *decode_page_token(token, order, descending), descending)
+        sql += f' WHERE {clause}'
+    sql += f' ORDER BY {key} {direction}, rowid {direction} LIMIT ?'
+    params.append(page_size + 1)
+    rows = conn.execute(sql, params).fetchall()
+    next_token = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_token = encode_page_token(order, descending, rows[-1][-2], rows[-1][-1])
+    return [row[:-2] for row in rows], next_token
+
+@cache.cached()
 def get_anime_by_id(anime_id):
     conn = create_connection()
     with conn:
@@ -141,7 +1245,17 @@ def get_anime_by_id(anime_id):
 def search_anime_by_title(title):
     conn = create_connection()
     with conn:
-        cursor = conn.execute('SELECT * FROM anime WHERE title LIKE ?', ('%' + title + '%',))
+        query = build_match_query(title)
+        if query and has_search_index():
+            cursor = conn.execute('''
+                SELECT anime.*
+                FROM anime_fts
+                JOIN anime ON anime.rowid = anime_fts.rowid
+                WHERE anime_fts MATCH ?
+                ORDER BY bm25(anime_fts)
+            ''', (query,))
+        else:
+            cursor = conn.execute('SELECT * FROM anime WHERE title LIKE ?', ('%' + title + '%',))
         return cursor.fetchall()
 
 def filter_anime_by_genre(genre_id):
@@ -180,43 +1294,172 @@ def filter_anime_by_statuses(statuses):
         cursor = conn.execute(query, statuses)
         return cursor.fetchall()
 
-def export_to_csv(filename):
+def export_format(filename):
+    name = filename[:-3] if filename.endswith('.gz') else filename
+    return 'jsonl' if name.endswith(('.jsonl', '.json')) else 'csv'
+
+def open_export_file(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wt', newline='', encoding='utf-8')
+    return open(filename, 'w', newline='', encoding='utf-8')
+
+def export_table(source, filename, columns=None, where=None, params=(), fmt=None,
+                 chunk_size=EXPORT_CHUNK_SIZE, progress=None):
     conn = create_connection()
-    with conn:
-        cursor = conn.execute('SELECT * FROM anime')
-        with open(filename, 'w', newline='') as f:
+    if source in EXPORT_VIEWS:
+        source_sql = f'({EXPORT_VIEWS[source]})'
+    elif conn.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (source,)).fetchone():
+        source_sql = f'"{source}"'
+    else:
+        raise ValueError(f'Unknown table or view: {source}')
+    if columns:
+        # SQLite reads an unknown double-quoted name as a string literal, so
+        # check the names against the source instead of trusting the quotes.
+        known = [desc[0] for desc in conn.execute(f'SELECT * FROM {source_sql} LIMIT 0').description]
+        unknown = [column for column in columns if column not in known]
+        if unknown:
+            raise ValueError(f'Unknown column(s) in {source}: {", ".join(unknown)}')
+    projection = ', '.join(f'"{column}"' for column in columns) if columns else '*'
+    sql = f'SELECT {projection} FROM {source_sql}'
+    if where:
+        sql += f' WHERE {where}'
+    fmt = fmt or export_format(filename)
+    cursor = conn.execute(sql, params)
+    names = [desc[0] for desc in cursor.description]
+    count = 0
+    with open_export_file(filename) as f:
+        if fmt == 'csv':
             writer = csv.writer(f)
-            writer.writerow([desc[0] for desc in cursor.description])
-            writer.writerows(cursor)
+            writer.writerow(names)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if fmt == 'csv':
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n' for row in rows)
+            count += len(rows)
+            if progress:
+                progress(count)
+    return count
+
+def export_to_csv(filename):
+    return export_table('anime', filename, fmt='csv')
+
+def parse_episodes(value):
+    # Empty means unknown, which is how export_to_csv writes NULL.
+    return int(value) if value not in (None, '') else None
+
+def import_from_csv(filename, batch_size=BULK_BATCH_SIZE, fast=True):
+    # Reads what export_to_csv writes. A bad value raises ValueError and a
+    # missing title column KeyError; either way nothing is imported.
+    with open(filename, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        rows = ((row['title'], parse_episodes(row.get('episodes')), row.get('status') or None,
+                 parse_rating(row.get('rating'))) for row in reader)
+        return insert_many('anime', ('title', 'episodes', 'status', 'rating'), rows, batch_size, fast)
 
-def backup_database():
+def backup_prefix():
+    return os.path.splitext(DB_PATH)[0] + '_backup_'
+
+def list_backups():
+    return sorted(glob.glob(backup_prefix() + '*.db') + glob.glob(backup_prefix() + '*.db.gz'))
+
+def prune_backups(keep=BACKUP_KEEP):
+    # keep counts the newest backup too, so it must be at least one.
+    if keep < 1:
+        raise ValueError(f'keep must be at least 1, got {keep}')
+    backups = list_backups()
+    removed = backups[:-keep]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+def verify_backup(backup_file):
+    conn = sqlite3.connect(backup_file)
+    try:
+        return conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    finally:
+        conn.close()
+
+def backup_database(pages=BACKUP_PAGES_PER_STEP, compress=False, keep=BACKUP_KEEP, verify=True, progress=None):
+    if keep is not None and keep < 1:
+        raise ValueError(f'keep must be at least 1, got {keep}')
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_file = f'anime_list_backup_{timestamp}.db'
-    shutil.copy('anime_list.db', backup_file)
+    backup_file = f'{backup_prefix()}{timestamp}.db'
+    target = sqlite3.connect(backup_file)
+    try:
+        # Copies a few pages at a time so other connections can keep reading
+        # and writing between steps; the backup restarts if they change it.
+        create_connection().backup(target, pages=pages, progress=progress)
+    finally:
+        target.close()
+    if verify and not verify_backup(backup_file):
+        os.remove(backup_file)
+        raise sqlite3.DatabaseError(f'Backup {backup_file} failed integrity check')
+    if compress:
+        with open(backup_file, 'rb') as src, gzip.open(backup_file + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(backup_file)
+        backup_file += '.gz'
+    if keep is not None:
+        prune_backups(keep)
     print(f"Database backed up to {backup_file}.")
+    return backup_file
+
+def insert_preference(conn, user_id, key, value):
+    return conn.execute('''
+        INSERT INTO preferences (user_id, key, value)
+        VALUES (?, ?, ?)
+    ''', (user_id, key, value)).lastrowid
+
+def change_preference(conn, user_id, key, value):
+    return conn.execute('''
+        UPDATE preferences
+        SET value = ?
+        WHERE user_id = ? AND key = ?
+    ''', (value, user_id, key)).rowcount
 
 def add_preference(user_id, key, value):
     conn = create_connection()
     with conn:
-        conn.execute('''
-            INSERT INTO preferences (user_id, key, value)
-            VALUES (?, ?, ?)
-        ''', (user_id, key, value))
+        rowid = insert_preference(conn, user_id, key, value)
+    cache.invalidate('get_preferences', user_id)
+    return rowid
 
 def update_preference(user_id, key, value):
     conn = create_connection()
     with conn:
-        conn.execute('''
-            UPDATE preferences
-            SET value = ?
-            WHERE user_id = ? AND key = ?
-        ''', (value, user_id, key))
+        changed = change_preference(conn, user_id, key, value)
+    cache.invalidate('get_preferences', user_id)
+    return changed
+
+def save_preferences(conn, user_id, preferences):
+    # preferences maps keys to values; new keys are added, existing ones
+    # overwritten. Returns how many were written.
+    items = list(dict(preferences).items())
+    conn.executemany('''
+        INSERT INTO preferences (user_id, key, value)
+        VALUES (?, ?, ?)
+        ON CONFLICT (user_id, key) DO UPDATE SET value = excluded.value
+    ''', [(user_id, key, value) for key, value in items])
+    return len(items)
+
+def set_preferences(user_id, preferences):
+    conn = create_connection()
+    with conn:
+        count = save_preferences(conn, user_id, preferences)
+    cache.invalidate('get_preferences', user_id)
+    return count
 
 def delete_preference(user_id, key):
     conn = create_connection()
     with conn:
         conn.execute('DELETE FROM preferences WHERE user_id = ? AND key = ?', (user_id, key))
+    cache.invalidate('get_preferences', user_id)
 
+@cache.cached()
 def get_preferences(user_id):
     conn = create_connection()
     with conn:
@@ -234,6 +1477,7 @@ def add_genre(name):
             INSERT INTO genre (name)
             VALUES (?)
         ''', (name,))
+    cache.clear('get_all_genres')
 
 def update_genre(genre_id, new_name):
     conn = create_connection()
@@ -243,16 +1487,59 @@ def update_genre(genre_id, new_name):
             SET name = ?
             WHERE id = ?
         ''', (new_name, genre_id))
+    cache.clear('get_all_genres')
 
 def delete_genre(genre_id):
     conn = create_connection()
     with conn:
         conn.execute('DELETE FROM genre WHERE id = ?', (genre_id,))
+    cache.clear('get_all_genres')
 
+@cache.cached()
 def get_all_genres():
     conn = create_connection()
     with conn:
         cursor = conn.execute('SELECT * FROM genre')
         return cursor.fetchall()
 
-create_table()
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {value}')
+    return value
+
+def main():
+    parser = argparse.ArgumentParser(description='Anime list database maintenance')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('migrate', help='apply pending schema migrations')
+    commands.add_parser('rebuild-search', help='rebuild the full-text search indexes')
+    commands.add_parser('rebuild-trigrams', help='rebuild the fuzzy title search index')
+    commands.add_parser('rebuild-ratings', help='recompute the rating summary tables from reviews')
+    commands.add_parser('refresh-rankings', help='rescore every anime against the current mean rating')
+    backup = commands.add_parser('backup', help='take an online backup of the database')
+    backup.add_argument('--compress', action='store_true', help='gzip the backup file')
+    backup.add_argument('--keep', type=positive_int, default=BACKUP_KEEP, help='number of backups to retain')
+    args = parser.parse_args()
+    create_table()
+    if args.command == 'migrate':
+        print(f"Schema is at version {schema_version()} of {len(MIGRATIONS)}.")
+    elif args.command == 'rebuild-search':
+        if not has_search_index():
+            print("This SQLite build does not support FTS5.")
+            return
+        rebuild_search_index()
+        print("Search index rebuilt.")
+    elif args.command == 'rebuild-trigrams':
+        rebuild_trigram_index()
+        print("Trigram index rebuilt.")
+    elif args.command == 'rebuild-ratings':
+        rebuild_rating_summary()
+        print("Rating summaries rebuilt.")
+    elif args.command == 'refresh-rankings':
+        refresh_rankings()
+        print("Rankings refreshed.")
+    elif args.command == 'backup':
+        backup_database(compress=args.compress, keep=args.keep)
+
+if __name__ == '__main__':
+    main()
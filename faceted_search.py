@@ -0,0 +1,113 @@
+from collections import namedtuple
+
+import cache
+import database
+
+# Facet counts depend only on the filters and the data, not the page, so
+# they are kept briefly and reused while the user pages through one result
+# set. Keys carry database.catalog_version, so any write makes them stale.
+FACET_CACHE = cache.LRUCache(maxsize=256, ttl=30)
+
+FacetedResult = namedtuple('FacetedResult', ['rows', 'next_token', 'total', 'genre_counts', 'status_counts'])
+
+def build_filter(conn, title=None, genre_ids=(), statuses=(), min_rating=None, max_rating=None,
+                 match_all_genres=False):
+    columns = database.table_columns(conn, 'anime')
+    clauses = []
+    params = []
+    if title:
+        query = database.build_match_query(title)
+        if query and database.has_search_index():
+            clauses.append('anime.rowid IN (SELECT rowid FROM anime_fts WHERE anime_fts MATCH ?)')
+            params.append(query)
+        else:
+            clauses.append('anime.title LIKE ?')
+            params.append('%' + title + '%')
+    if genre_ids:
+        placeholders = ','.join('?' * len(genre_ids))
+        if match_all_genres:
+            clauses.append(f'''anime.rowid IN (
+                SELECT anime_id FROM anime_genre WHERE genre_id IN ({placeholders})
+                GROUP BY anime_id HAVING COUNT(*) = ?)''')
+            params.extend(genre_ids)
+            params.append(len(set(genre_ids)))
+        else:
+            clauses.append(f'anime.rowid IN (SELECT anime_id FROM anime_genre WHERE genre_id IN ({placeholders}))')
+            params.extend(genre_ids)
+    if statuses:
+        clauses.append('anime.status IN ({})'.format(','.join('?' * len(statuses))))
+        params.extend(statuses)
+    if min_rating is not None or max_rating is not None:
+        low = min_rating if min_rating is not None else 0
+        high = max_rating if max_rating is not None else 10
+        if 'rating' in columns:
+            clauses.append('anime.rating BETWEEN ? AND ?')
+        else:
+            # Without a rating column, filter on the average review rating.
+            clauses.append('''anime.rowid IN (
+                SELECT anime_id FROM anime_rating_summary
+                WHERE review_count > 0 AND rating_sum >= ? * review_count AND rating_sum <= ? * review_count)''')
+        params.extend((low, high))
+    where = ' AND '.join(clauses) if clauses else '1'
+    return where, params
+
+def facet_counts(conn, where, params):
+    key = (database.DB_PATH, database.catalog_version(conn), where, tuple(params))
+    hit, counts = FACET_CACHE.get(key)
+    if hit:
+        return counts
+    version = FACET_CACHE.version
+    status = 'anime.status' if 'status' in database.table_columns(conn, 'anime') else 'NULL'
+    # One statement: the filter runs once and every facet reads from it.
+    rows = conn.execute(f'''
+        WITH matches AS MATERIALIZED (
+            SELECT anime.rowid AS id, {status} AS status FROM anime WHERE {where}
+        )
+        SELECT 'total', NULL, NULL, COUNT(*) FROM matches
+        UNION ALL
+        SELECT 'genre', genre.id, genre.name, COUNT(*)
+        FROM matches
+        JOIN anime_genre ON anime_genre.anime_id = matches.id
+        JOIN genre ON genre.id = anime_genre.genre_id
+        GROUP BY genre.id
+        UNION ALL
+        SELECT 'status', NULL, status, COUNT(*) FROM matches WHERE status IS NOT NULL GROUP BY status
+    ''', params).fetchall()
+    total = 0
+    genre_counts = []
+    status_counts = []
+    for kind, genre_id, name, count in rows:
+        if kind == 'total':
+            total = count
+        elif kind == 'genre':
+            genre_counts.append((genre_id, name, count))
+        else:
+            status_counts.append((name, count))
+    genre_counts.sort(key=lambda facet: -facet[2])
+    status_counts.sort(key=lambda facet: -facet[1])
+    counts = (total, genre_counts, status_counts)
+    FACET_CACHE.set(key, counts, version)
+    return counts
+
+def faceted_search(title=None, genre_ids=(), statuses=(), min_rating=None, max_rating=None,
+                   match_all_genres=False, token=None, page_size=database.PAGE_SIZE):
+    conn = database.create_connection()
+    where, params = build_filter(conn, title, genre_ids, statuses, min_rating, max_rating, match_all_genres)
+    total, genre_counts, status_counts = facet_counts(conn, where, params)
+    page_where = where
+    page_params = list(params)
+    if token:
+        last_rowid = database.decode_page_token(token, 'facets', False)[1]
+        page_where += ' AND anime.rowid > ?'
+        page_params.append(last_rowid)
+    rows = conn.execute(f'''
+        SELECT anime.*, anime.rowid FROM anime
+        WHERE {page_where}
+        ORDER BY anime.rowid
+        LIMIT ?
+    ''', page_params + [page_size + 1]).fetchall()
+    next_token = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_token = database.encode_page_token('facets', False, rows[-1][-1], rows[-1][-1])
+    return FacetedResult([row[:-1] for row in rows], next_token, total, genre_counts, status_counts)
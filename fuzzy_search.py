@@ -0,0 +1,169 @@
+import heapq
+import math
+
+import cache
+import database
+from genre_index import bitmap_ids
+
+THRESHOLD = 0.3
+LIMIT = 10
+FETCH_CHUNK_SIZE = 900
+
+# trigram -> (log position, Python int bitset of the anime containing it),
+# as in genre_index. Keys carry the index generation, so a rebuild or bulk
+# load makes every entry unreachable; after smaller writes an entry catches
+# up from anime_trigram_log instead of being reloaded. A bitset is at most one
+# bit per anime id (about 12 KB at 100k titles).
+POSTING_CACHE = cache.LRUCache(maxsize=2048, ttl=600)
+
+def to_bitmap(anime_ids):
+    bits = bytearray(max(anime_ids) // 8 + 1)
+    for anime_id in anime_ids:
+        bits[anime_id >> 3] |= 1 << (anime_id & 7)
+    return int.from_bytes(bits, 'little')
+
+def placeholders(values):
+    return ','.join('?' * len(values))
+
+def log_position(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'anime_trigram_log'").fetchone()
+    return row[0] if row else 0
+
+def catch_up(conn, stale):
+    # stale maps trigram -> (position, bits). Returns the bitsets with the
+    # changes logged since each position applied, or None if the log has
+    # been pruned past the oldest of them.
+    oldest = min(position for position, _ in stale.values())
+    first = conn.execute('SELECT MIN(seq) FROM anime_trigram_log').fetchone()[0]
+    if first is None or first > oldest + 1:
+        return None
+    bitmaps = {trigram: bits for trigram, (_, bits) in stale.items()}
+    cursor = conn.execute(f'''
+        SELECT seq, trigram, anime_id, added
+        FROM anime_trigram_log
+        WHERE seq > ? AND trigram IN ({placeholders(stale)})
+        ORDER BY seq
+    ''', [oldest, *stale])
+    for seq, trigram, anime_id, added in cursor:
+        if seq > stale[trigram][0]:
+            if added:
+                bitmaps[trigram] |= 1 << anime_id
+            else:
+                bitmaps[trigram] &= ~(1 << anime_id)
+    return bitmaps
+
+def load_postings(conn, generation, trigrams):
+    position = log_position(conn)
+    bitmaps = {}
+    stale = {}
+    for trigram in trigrams:
+        hit, entry = POSTING_CACHE.get((database.DB_PATH, generation, trigram))
+        if hit and entry[0] == position:
+            bitmaps[trigram] = entry[1]
+        elif hit:
+            stale[trigram] = entry
+    missing = [trigram for trigram in trigrams if trigram not in bitmaps and trigram not in stale]
+    cache_version = POSTING_CACHE.version
+    if stale:
+        caught_up = catch_up(conn, stale)
+        if caught_up is None:
+            missing.extend(stale)
+        else:
+            bitmaps.update(caught_up)
+    if missing:
+        members = {trigram: [] for trigram in missing}
+        cursor = conn.execute(f'SELECT trigram, anime_id FROM anime_trigram WHERE trigram IN ({placeholders(missing)})',
+                              missing)
+        for trigram, anime_id in cursor:
+            members[trigram].append(anime_id)
+        for trigram, anime_ids in members.items():
+            bitmaps[trigram] = to_bitmap(anime_ids) if anime_ids else 0
+    for trigram in set(stale) | set(missing):
+        POSTING_CACHE.set((database.DB_PATH, generation, trigram), (position, bitmaps[trigram]), cache_version)
+    return [bitmaps[trigram] for trigram in trigrams]
+
+def count_bits(bitmaps):
+    # Bit-sliced counter: planes[n] holds bit n of every anime's count of
+    # shared trigrams, so adding a bitmap is a ripple carry over a few ints.
+    planes = []
+    for bits in bitmaps:
+        level = 0
+        while bits:
+            if level == len(planes):
+                planes.append(bits)
+                break
+            carry = planes[level] & bits
+            planes[level] ^= bits
+            bits = carry
+            level += 1
+    return planes
+
+def at_least(planes, needed):
+    # Bitset of anime whose count is >= needed, comparing from the top plane.
+    if needed >> len(planes):
+        return 0
+    above = 0
+    equal = 0
+    for bits in planes:
+        equal |= bits
+    for level in reversed(range(len(planes))):
+        if needed >> level & 1:
+            equal &= planes[level]
+        else:
+            above |= equal & planes[level]
+            equal &= ~planes[level]
+    return above | equal
+
+def by_count(planes, needed, most):
+    # (count, anime ids sharing exactly that many trigrams), highest count
+    # first, down to needed.
+    above = 0
+    for count in range(most, needed - 1, -1):
+        bits = at_least(planes, count)
+        yield count, bitmap_ids(bits & ~above)
+        above = bits
+
+def fetch_sizes(conn, anime_ids):
+    sizes = {}
+    for start in range(0, len(anime_ids), FETCH_CHUNK_SIZE):
+        chunk = anime_ids[start:start + FETCH_CHUNK_SIZE]
+        sizes.update(conn.execute('SELECT anime_id, size FROM anime_trigram_size WHERE anime_id IN ({})'.format(
+            ','.join('?' * len(chunk))), chunk))
+    return sizes
+
+def search(text, threshold=THRESHOLD, limit=LIMIT):
+    # Titles ranked by Jaccard similarity of their trigram sets with the
+    # query. Returns (rowid, title, similarity) tuples, best first.
+    query = sorted(database.title_trigrams(text))
+    if not query:
+        return []
+    conn = database.create_connection()
+    started = not conn.in_transaction
+    if started:
+        conn.execute('BEGIN')
+    try:
+        generation = conn.execute('SELECT version FROM trigram_index_state WHERE id = 1').fetchone()[0]
+        planes = count_bits(load_postings(conn, generation, query))
+        # similarity = shared / (|query| + |title| - shared) <= shared / |query|,
+        # so anything sharing fewer trigrams than this cannot qualify.
+        needed = max(1, math.ceil(threshold * len(query) - 1e-9))
+        scored = []
+        for overlap, candidates in by_count(planes, needed, len(query)):
+            # Later groups share fewer trigrams and cannot beat shared/|query|;
+            # stop once limit results are already better than that.
+            if len(scored) >= limit and heapq.nlargest(limit, scored)[-1][0] > overlap / len(query):
+                break
+            sizes = fetch_sizes(conn, candidates)
+            for anime_id in candidates:
+                similarity = overlap / (len(query) + sizes.get(anime_id, overlap) - overlap)
+                if similarity >= threshold:
+                    scored.append((similarity, -anime_id))
+        best = heapq.nlargest(limit, scored)
+        best_ids = [-anime_id for _, anime_id in best]
+        titles = dict(conn.execute('SELECT rowid, title FROM anime WHERE rowid IN ({})'.format(
+            ','.join('?' * len(best_ids))), best_ids)) if best_ids else {}
+    finally:
+        if started:
+            conn.commit()
+    return [(anime_id, titles[anime_id], similarity)
+            for (similarity, _), anime_id in zip(best, best_ids) if anime_id in titles]
@@ -0,0 +1,188 @@
+import re
+import threading
+
+import database
+
+FETCH_CHUNK_SIZE = 900
+TOKEN_PATTERN = re.compile(r'\s*(\(|\)|"[^"]*"|[^\s()]+)')
+
+class GenreIndex:
+    # genre_id -> Python int used as a bitset, bit n set when anime n has the
+    # genre. &, | and ~ on these run in C, so set algebra over the whole
+    # catalog takes microseconds.
+    def __init__(self):
+        self.bitmaps = {}
+        self.last_seq = 0
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def rebuild(self, conn):
+        members = {}
+        for anime_id, genre_id in conn.execute('SELECT anime_id, genre_id FROM anime_genre'):
+            members.setdefault(genre_id, []).append(anime_id)
+        bitmaps = {}
+        for genre_id, anime_ids in members.items():
+            bits = bytearray(max(anime_ids) // 8 + 1)
+            for anime_id in anime_ids:
+                bits[anime_id >> 3] |= 1 << (anime_id & 7)
+            bitmaps[genre_id] = int.from_bytes(bits, 'little')
+        self.bitmaps = bitmaps
+
+    def apply(self, changes):
+        for anime_id, genre_id, added in changes:
+            bit = 1 << anime_id
+            if added:
+                self.bitmaps[genre_id] = self.bitmaps.get(genre_id, 0) | bit
+            else:
+                self.bitmaps[genre_id] = self.bitmaps.get(genre_id, 0) & ~bit
+
+    def refresh(self):
+        conn = database.create_connection()
+        with self.lock:
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'anime_genre_log'").fetchone()
+            max_seq = row[0] if row else 0
+            if self.loaded and max_seq == self.last_seq:
+                return
+            # Read the log position and the data from one snapshot.
+            started = not conn.in_transaction
+            if started:
+                conn.execute('BEGIN')
+            try:
+                min_seq = conn.execute('SELECT MIN(seq) FROM anime_genre_log').fetchone()[0]
+                max_seq = conn.execute('SELECT IFNULL(MAX(seq), ?) FROM anime_genre_log', (max_seq,)).fetchone()[0]
+                if not self.loaded or min_seq is None or min_seq > self.last_seq + 1:
+                    # Never loaded, or the log was pruned past our position.
+                    self.rebuild(conn)
+                else:
+                    self.apply(conn.execute('''
+                        SELECT anime_id, genre_id, added
+                        FROM anime_genre_log
+                        WHERE seq > ?
+                        ORDER BY seq
+                    ''', (self.last_seq,)))
+            finally:
+                if started:
+                    conn.commit()
+            self.last_seq = max_seq
+            self.loaded = True
+
+    def bitmap(self, genre_id):
+        return self.bitmaps.get(genre_id, 0)
+
+    def universe(self):
+        # NOT is taken relative to anime that have at least one genre.
+        result = 0
+        for bits in self.bitmaps.values():
+            result |= bits
+        return result
+
+_index = GenreIndex()
+
+def get_index():
+    _index.refresh()
+    return _index
+
+def bitmap_ids(bits):
+    digits = bin(bits)[:1:-1]
+    ids = []
+    position = digits.find('1')
+    while position != -1:
+        ids.append(position)
+        position = digits.find('1', position + 1)
+    return ids
+
+def match(all_of=(), any_of=(), none_of=()):
+    index = get_index()
+    if all_of:
+        result = index.bitmap(all_of[0])
+        for genre_id in all_of[1:]:
+            result &= index.bitmap(genre_id)
+    else:
+        result = index.universe()
+    if any_of:
+        either = 0
+        for genre_id in any_of:
+            either |= index.bitmap(genre_id)
+        result &= either
+    for genre_id in none_of:
+        result &= ~index.bitmap(genre_id)
+    return bitmap_ids(result)
+
+def resolve_genre(token):
+    if token.isdigit():
+        return int(token)
+    name = token.strip('"')
+    conn = database.create_connection()
+    row = conn.execute('SELECT id FROM genre WHERE name = ? COLLATE NOCASE', (name,)).fetchone()
+    if row is None:
+        raise ValueError(f'Unknown genre: {name}')
+    return row[0]
+
+def tokenize(expression):
+    tokens = TOKEN_PATTERN.findall(expression)
+    if ''.join(tokens).replace(' ', '') != expression.replace(' ', ''):
+        raise ValueError(f'Cannot parse genre expression: {expression}')
+    return tokens
+
+def evaluate(expression):
+    # Grammar: expr := term (OR term)*, term := factor (AND factor)*,
+    # factor := NOT factor | '(' expr ')' | genre id | genre name.
+    index = get_index()
+    tokens = tokenize(expression)
+    position = 0
+
+    def peek():
+        return tokens[position].upper() if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        if position >= len(tokens):
+            raise ValueError(f'Unexpected end of genre expression: {expression}')
+        position += 1
+        return tokens[position - 1]
+
+    def parse_expr():
+        result = parse_term()
+        while peek() == 'OR':
+            take()
+            result |= parse_term()
+        return result
+
+    def parse_term():
+        result = parse_factor()
+        while peek() == 'AND':
+            take()
+            result &= parse_factor()
+        return result
+
+    def parse_factor():
+        token = take()
+        if token.upper() == 'NOT':
+            return index.universe() & ~parse_factor()
+        if token == '(':
+            result = parse_expr()
+            if take() != ')':
+                raise ValueError(f'Missing ) in genre expression: {expression}')
+            return result
+        if token.upper() in ('AND', 'OR') or token == ')':
+            raise ValueError(f'Unexpected {token} in genre expression: {expression}')
+        return index.bitmap(resolve_genre(token))
+
+    result = parse_expr()
+    if position != len(tokens):
+        raise ValueError(f'Unexpected {tokens[position]} in genre expression: {expression}')
+    return bitmap_ids(result)
+
+def fetch_anime(anime_ids, limit=None):
+    if limit is not None:
+        anime_ids = anime_ids[:limit]
+    conn = database.create_connection()
+    rows = []
+    for start in range(0, len(anime_ids), FETCH_CHUNK_SIZE):
+        chunk = anime_ids[start:start + FETCH_CHUNK_SIZE]
+        query = 'SELECT * FROM anime WHERE rowid IN ({}) ORDER BY rowid'.format(','.join('?' * len(chunk)))
+        rows.extend(conn.execute(query, chunk))
+    return rows
+
+def search(expression, limit=None):
+    return fetch_anime(evaluate(expression), limit)
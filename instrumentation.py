@@ -0,0 +1,320 @@
+import atexit
+import functools
+import inspect
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import database
+
+# Off by default. enable() swaps every data-access function in database.py
+# for a timing wrapper and installs a trace callback on each connection;
+# disable() puts the originals back, so a disabled process runs exactly the
+# uninstrumented code.
+SLOW_THRESHOLD = 0.1
+SLOW_LOG_SIZE = 100
+# Distinct statements remembered per call site; later ones are only counted.
+SQL_PER_SITE = 50
+# Upper bounds in seconds, Prometheus style; the last bucket is +Inf.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Statements run outside any wrapped call, e.g. from repository.py.
+UNATTRIBUTED = '<unattributed>'
+METRICS_ENV = 'ANIME_DB_METRICS'
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+NOT_INSTRUMENTED = {'create_connection', 'ensure_schema', 'main'}
+
+_lock = threading.Lock()
+_local = threading.local()
+_originals = {}
+_sites = {}
+_slow_log = deque(maxlen=SLOW_LOG_SIZE)
+_threshold = SLOW_THRESHOLD
+_report_path = None
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+def normalize_sql(sql):
+    # The trace callback sees statements with their parameters expanded;
+    # fold literals back into placeholders so one query is one entry.
+    return ' '.join(LITERALS.sub('?', sql).split())
+
+class SiteStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.statements = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sql = {}
+
+    def observe(self, seconds, rows, failed):
+        self.calls += 1
+        self.errors += failed
+        self.seconds += seconds
+        self.rows += rows
+        self.slow += seconds >= _threshold
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def record_sql(self, sql):
+        self.statements += 1
+        key = normalize_sql(sql)
+        if key in self.sql or len(self.sql) < SQL_PER_SITE:
+            self.sql[key] = self.sql.get(key, 0) + 1
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of calls.
+        needed = fraction * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.buckets):
+            seen += count
+            if count and seen >= needed:
+                return bound
+        return None
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'slow': self.slow,
+            'seconds_total': round(self.seconds, 6),
+            'rows_total': self.rows,
+            'statements_total': self.statements,
+            'buckets': {str(bound): count for bound, count in zip(BUCKETS + ('+Inf',), self.buckets)},
+            'p50_upper': self.quantile(0.5),
+            'p95_upper': self.quantile(0.95),
+            'p99_upper': self.quantile(0.99),
+            'sql': dict(sorted(self.sql.items(), key=lambda item: -item[1])),
+        }
+
+def site(name):
+    stats = _sites.get(name)
+    if stats is None:
+        stats = _sites.setdefault(name, SiteStats())
+    return stats
+
+def active_calls():
+    calls = getattr(_local, 'calls', None)
+    if calls is None:
+        calls = _local.calls = []
+    return calls
+
+def trace(sql):
+    # Statements run by triggers and FTS internals arrive as '-- ...' and
+    # each trigger step reports its parent statement again; keep only the
+    # statements the code itself issued.
+    if sql.startswith('--') or getattr(_local, 'explaining', False):
+        return
+    calls = active_calls()
+    if calls:
+        statements = calls[-1][1]
+        if not statements or statements[-1] != sql:
+            statements.append(sql)
+    else:
+        with _lock:
+            site(UNATTRIBUTED).record_sql(sql)
+
+def count_rows(result):
+    # Best effort: lists are rows, get_anime_page-style (rows, token) pairs
+    # count their rows, None is nothing and anything else is one value.
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return 1
+
+def explain(statements):
+    # EXPLAIN QUERY PLAN for each distinct data statement of a slow call,
+    # run on this thread's connection after the call has finished.
+    plans = {}
+    conn = database.create_connection()
+    _local.explaining = True
+    try:
+        for sql in dict.fromkeys(statements):
+            if not sql.lstrip().upper().startswith(EXPLAINABLE):
+                continue
+            try:
+                rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+            except sqlite3.Error as e:
+                plans[sql] = [f'unavailable: {e}']
+            else:
+                plans[sql] = [detail for _, _, _, detail in rows]
+    finally:
+        _local.explaining = False
+    return plans
+
+def describe_args(args, kwargs, limit=200):
+    text = ', '.join([repr(arg) for arg in args] + [f'{key}={value!r}' for key, value in kwargs.items()])
+    return text if len(text) <= limit else text[:limit] + '...'
+
+def instrument(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        statements = []
+        calls = active_calls()
+        calls.append((name, statements))
+        failed = False
+        result = None
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            calls.pop()
+            with _lock:
+                stats = site(name)
+                stats.observe(seconds, 0 if failed else count_rows(result), failed)
+                for sql in statements:
+                    stats.record_sql(sql)
+            if seconds >= _threshold:
+                _slow_log.append({
+                    'function': name,
+                    'seconds': round(seconds, 6),
+                    'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'args': describe_args(args, kwargs),
+                    'failed': failed,
+                    'statements': statements,
+                    'plans': explain(statements),
+                })
+
+    wrapper.instrumented = func
+    return wrapper
+
+def data_access_functions():
+    # Public database.py functions that open a connection themselves or
+    # call one that does. Helpers taking a conn run inside such a call and
+    # are attributed to it; context managers cannot be timed by wrapping.
+    functions = {}
+    for name, func in inspect.getmembers(database, inspect.isfunction):
+        if name.startswith(('_', 'migration_')) or func.__module__ != database.__name__:
+            continue
+        parameters = list(inspect.signature(func).parameters)
+        if parameters and parameters[0] == 'conn':
+            continue
+        functions[name] = getattr(func, 'instrumented', func)
+    touching = {'create_connection'}
+    changed = True
+    while changed:
+        changed = False
+        for name, func in functions.items():
+            if name not in touching and touching & set(inspect.unwrap(func).__code__.co_names):
+                touching.add(name)
+                changed = True
+    return {name: func for name, func in functions.items()
+            if name in touching and name not in NOT_INSTRUMENTED and not inspect.isgeneratorfunction(inspect.unwrap(func))}
+
+def enable(slow_threshold=SLOW_THRESHOLD):
+    global _threshold
+    with _lock:
+        _threshold = slow_threshold
+        if _originals:
+            return
+        for name, func in data_access_functions().items():
+            _originals[name] = func
+            setattr(database, name, instrument(name, func))
+        database.TRACE_CALLBACK = trace
+    for conn in database.open_connections():
+        conn.set_trace_callback(trace)
+
+def disable():
+    with _lock:
+        for name, func in _originals.items():
+            setattr(database, name, func)
+        _originals.clear()
+        database.TRACE_CALLBACK = None
+    for conn in database.open_connections():
+        conn.set_trace_callback(None)
+
+def is_enabled():
+    return bool(_originals)
+
+def reset():
+    with _lock:
+        _sites.clear()
+        _slow_log.clear()
+
+def slow_queries():
+    return list(_slow_log)
+
+def snapshot():
+    with _lock:
+        return {
+            'enabled': is_enabled(),
+            'slow_threshold': _threshold,
+            'sites': {name: stats.snapshot() for name, stats in sorted(_sites.items())},
+            'slow_queries': list(_slow_log),
+        }
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus(prefix='anime_db'):
+    # Text exposition format, one series per call site.
+    with _lock:
+        sites = sorted((name, stats) for name, stats in _sites.items() if stats.calls)
+        lines = [
+            f'# HELP {prefix}_call_duration_seconds Time spent in database.py calls.',
+            f'# TYPE {prefix}_call_duration_seconds histogram',
+        ]
+        for name, stats in sites:
+            label = f'function="{escape_label(name)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), stats.buckets):
+                cumulative += count
+                lines.append(f'{prefix}_call_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_call_duration_seconds_sum{{{label}}} {stats.seconds:.6f}')
+            lines.append(f'{prefix}_call_duration_seconds_count{{{label}}} {stats.calls}')
+        for metric, attribute, description in (
+                ('rows_returned_total', 'rows', 'Rows returned by database.py calls.'),
+                ('statements_total', 'statements', 'SQL statements executed per call site.'),
+                ('errors_total', 'errors', 'database.py calls that raised.'),
+                ('slow_calls_total', 'slow', 'Calls slower than the slow-query threshold.')):
+            lines.append(f'# HELP {prefix}_{metric} {description}')
+            lines.append(f'# TYPE {prefix}_{metric} counter')
+            for name, stats in sorted(_sites.items()):
+                lines.append(f'{prefix}_{metric}{{function="{escape_label(name)}"}} {getattr(stats, attribute)}')
+    return '\n'.join(lines) + '\n'
+
+def write(path):
+    # Prometheus text for .prom/.txt files, a JSON snapshot otherwise.
+    if path.endswith(('.prom', '.txt')):
+        text = prometheus()
+    else:
+        text = json.dumps(snapshot(), indent=2)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def enable_from_environment():
+    # ANIME_DB_METRICS=metrics.json (or .prom) turns instrumentation on for
+    # the whole run and writes the metrics there on exit. Safe to call again;
+    # the report is only registered once.
+    global _report_path
+    path = os.environ.get(METRICS_ENV)
+    if not path:
+        return False
+    enable()
+    with _lock:
+        first = _report_path is None
+        _report_path = path
+    if first:
+        atexit.register(write_report)
+    return True
+
+def write_report():
+    write(_report_path)
@@ -1,4 +1,10 @@
 import database
+import genre_index
+import instrumentation
+import faceted_search
+import fuzzy_search
+import recommendations
+import repository
 
 def get_user_input(prompt, dtype, min_value=None, max_value=None):
     while True:
@@ -51,17 +57,57 @@ def get_user_id(username):
         user = cursor.fetchone()
         return user[0] if user else None
 
+def format_value(value):
+    return '-' if value is None else str(value)
+
 def print_anime_list(anime_list):
-    print(f"{'ID':<5} {'Title':<30} {'Episodes':<10} {'Status':<10}")
-    print("="*55)
+    print(f"{'ID':<5} {'Title':<30} {'Episodes':<10} {'Status':<10} {'Rating':<6}")
+    print("="*62)
     for anime in anime_list:
-        print(f"{anime[0]:<5} {anime[1]:<30} {anime[2]:<10} {anime[3]:<10}")
+        episodes, status, rating = (format_value(value) for value in anime[2:5])
+        print(f"{anime[0]:<5} {anime[1]:<30} {episodes:<10} {status:<10} {rating:<6}")
+
+def get_optional_rating(prompt):
+    while True:
+        text = input(prompt).strip()
+        if not text:
+            return None
+        rating = database.parse_rating(text)
+        if rating is not None:
+            return rating
+        print("Please enter a number between 0 and 10, or leave it blank.")
+
+def browse_anime():
+    order = input("Sort by id, title or rating (default: id): ").strip() or 'id'
+    tokens = [None]
+    while True:
+        try:
+            anime_list, next_token = database.get_anime_page(order, tokens[-1])
+        except ValueError as e:
+            print(e)
+            return
+        print_anime_list(anime_list)
+        options = []
+        if next_token:
+            options.append("[n]ext")
+        if len(tokens) > 1:
+            options.append("[p]revious")
+        options.append("[q]uit")
+        action = input(f"Page {len(tokens)}: {' '.join(options)}: ").strip().lower()
+        if action == 'n' and next_token:
+            tokens.append(next_token)
+        elif action == 'p' and len(tokens) > 1:
+            tokens.pop()
+        elif action == 'q':
+            return
 
 def add_anime():
     title = input("Enter anime title: ")
     episodes = get_user_input("Enter number of episodes: ", int, 1)
     status = input("Enter status (e.g., 'Completed', 'Ongoing'): ")
-    database.add_anime(title, episodes, status)
+    rating = get_optional_rating("Enter rating 0-10 (leave blank for none): ")
+    genres = database.split_genres(input("Enter genres, comma-separated (leave blank for none): "))
+    repository.add_anime(title, episodes, status, rating, genres)
     print("Anime added successfully!")
 
 def update_anime():
@@ -69,18 +115,38 @@ def update_anime():
     title = input("Enter new title: ")
     episodes = get_user_input("Enter new number of episodes: ", int, 1)
     status = input("Enter new status (e.g., 'Completed', 'Ongoing'): ")
-    database.update_anime(anime_id, title, episodes, status)
+    changes = {'title': title, 'episodes': episodes, 'status': status}
+    rating = get_optional_rating("Enter new rating 0-10 (leave blank to keep): ")
+    if rating is not None:
+        changes['rating'] = rating
+    genres = input("Enter new genres, comma-separated (leave blank to keep): ")
+    if genres.strip():
+        changes['genres'] = database.split_genres(genres)
+    if repository.update_anime(anime_id, **changes) is None:
+        print("Anime not found.")
+        return
     print("Anime updated successfully!")
 
 def delete_anime():
     anime_id = get_user_input("Enter anime ID to delete: ", int, 1)
-    database.delete_anime(anime_id)
+    if repository.delete_anime(anime_id) is None:
+        print("Anime not found.")
+        return
     print("Anime deleted successfully!")
 
 def search_anime_by_title():
     title = input("Enter anime title to search: ")
     anime_list = database.search_anime_by_title(title)
-    print_anime_list(anime_list)
+    if anime_list:
+        print_anime_list(anime_list)
+        return
+    suggestions = fuzzy_search.search(title)
+    if not suggestions:
+        print("No anime found.")
+        return
+    print("No exact matches. Did you mean:")
+    for anime_id, suggestion, similarity in suggestions:
+        print(f"ID: {anime_id}, Title: {suggestion} ({similarity:.0%} match)")
 
 def filter_anime_by_genre():
     genre_id = get_user_input("Enter genre ID to filter by: ", int, 1)
@@ -93,8 +159,15 @@ def filter_anime_by_status():
     print_anime_list(anime_list)
 
 def search_anime_by_genres():
-    genre_ids = list(map(int, input("Enter genre IDs (comma-separated): ").split(',')))
-    anime_list = database.search_anime_by_genres(genre_ids)
+    text = input("Enter genre IDs (comma-separated) or an expression like 'Action AND NOT Horror': ")
+    try:
+        if all(part.strip().isdigit() for part in text.split(',')):
+            anime_list = database.search_anime_by_genres([int(part) for part in text.split(',')])
+        else:
+            anime_list = genre_index.search(text)
+    except ValueError as e:
+        print(e)
+        return
     print_anime_list(anime_list)
 
 def filter_anime_by_statuses():
@@ -102,12 +175,71 @@ def filter_anime_by_statuses():
     anime_list = database.filter_anime_by_statuses(statuses)
     print_anime_list(anime_list)
 
+def view_top_rated():
+    genre_id = input("Enter genre ID to rank within (leave blank for all): ").strip()
+    status = input("Enter status to rank within (leave blank for all): ").strip()
+    top = database.get_top_rated(genre_id=int(genre_id) if genre_id.isdigit() else None, status=status or None)
+    if not top:
+        print("No rated anime found.")
+        return
+    print(f"{'#':<4} {'ID':<5} {'Title':<30} {'Score':<6} {'Reviews':<8} {'Average':<7}")
+    print("="*65)
+    for rank, (anime_id, title, score, count, average) in enumerate(top, 1):
+        print(f"{rank:<4} {anime_id:<5} {title:<30} {score:<6.2f} {count:<8} {average:<7.2f}")
+
+def search_anime_faceted():
+    title = input("Title contains (leave blank for any): ").strip()
+    genres = input("Genre IDs, comma-separated (leave blank for any): ").strip()
+    match_all = genres and input("Require all of these genres? (y/N): ").strip().lower() == 'y'
+    statuses = input("Statuses, comma-separated (leave blank for any): ").strip()
+    min_rating = input("Minimum rating (leave blank for none): ").strip()
+    max_rating = input("Maximum rating (leave blank for none): ").strip()
+    try:
+        criteria = dict(
+            title=title or None,
+            genre_ids=[int(part) for part in genres.split(',')] if genres else (),
+            statuses=[part.strip() for part in statuses.split(',')] if statuses else (),
+            min_rating=float(min_rating) if min_rating else None,
+            max_rating=float(max_rating) if max_rating else None,
+            match_all_genres=match_all,
+        )
+    except ValueError:
+        print("Genre IDs and ratings must be numbers.")
+        return
+    token = None
+    while True:
+        result = faceted_search.faceted_search(token=token, **criteria)
+        print(f"\n{result.total} matching anime")
+        if result.genre_counts:
+            print("Genres: " + ', '.join(f"{name} ({count})" for _, name, count in result.genre_counts))
+        if result.status_counts:
+            print("Statuses: " + ', '.join(f"{status} ({count})" for status, count in result.status_counts))
+        print_anime_list(result.rows)
+        if not result.next_token or input("[n]ext page or [q]uit: ").strip().lower() != 'n':
+            return
+        token = result.next_token
+
+def view_recommendations(user_id):
+    recommended = recommendations.recommend_for_user(user_id)
+    if not recommended:
+        print("No recommendations yet. Review a few more anime!")
+        return
+    print(f"{'ID':<5} {'Title':<30} {'Relevance':<9}")
+    print("="*45)
+    for anime_id, title, relevance in recommended:
+        print(f"{anime_id:<5} {title:<30} {relevance:<9.2f}")
+    anime_id = input("Enter an anime ID you rated to see similar anime (leave blank to skip): ").strip()
+    if anime_id.isdigit():
+        for similar_id, title, score in recommendations.because_you_rated(int(anime_id)):
+            print(f"{similar_id:<5} {title:<30} {score:<9.2f}")
+
 def add_review(user_id):
     anime_id = get_user_input("Enter anime ID to review: ", int, 1)
     rating = get_user_input("Enter your rating (1-10): ", int, 1, 10)
     review = input("Enter your review: ")
-    database.add_review(user_id, anime_id, rating, review)
-    print("Review added successfully!")
+    # Reviewing the same anime again replaces the earlier review.
+    database.upsert_review(user_id, anime_id, rating, review)
+    print("Review saved successfully!")
 
 def update_review():
     review_id = get_user_input("Enter review ID to update: ", int, 1)
@@ -155,7 +287,7 @@ def view_preferences(user_id):
 def update_preferences(user_id):
     key = input("Enter preference key to update: ")
     value = input("Enter new value: ")
-    database.update_preference(user_id, key, value)
+    database.set_preferences(user_id, {key: value})
     print("Preference updated successfully!")
 
 def add_genre():
@@ -181,7 +313,43 @@ def view_all_genres():
     for genre in genres:
         print(f"{genre[0]:<5} {genre[1]:<30}")
 
+def import_from_csv():
+    filename = input("Enter CSV filename to import (default: anime_list.csv): ")
+    if not filename:
+        filename = 'anime_list.csv'
+    try:
+        stats = database.import_from_csv(filename)
+    except FileNotFoundError:
+        print(f"File {filename} not found.")
+        return
+    except KeyError as e:
+        print(f"Missing column {e} in {filename}.")
+        return
+    except ValueError as e:
+        print(f"Invalid value in {filename}: {e}")
+        return
+    print(f"Imported {stats.rows} anime in {stats.seconds:.2f}s ({stats.rows_per_second:.0f} rows/s).")
+
+def print_export_progress(count):
+    print(f"\rExported {count} rows...", end='', flush=True)
+
+def export_data():
+    source = input("Enter table to export (default: anime): ") or 'anime'
+    filename = input(f"Enter filename for export, .csv/.jsonl with optional .gz (default: {source}.csv): ")
+    if not filename:
+        filename = f'{source}.csv'
+    try:
+        count = database.export_table(source, filename, progress=print_export_progress)
+    except ValueError as e:
+        print(e)
+        return
+    print(f"\rExported {count} rows from {source} to {filename}.")
+
+def print_backup_progress(status, remaining, total):
+    print(f"\rBacking up... {100 * (total - remaining) // total}%", end='', flush=True)
+
 def main():
+    database.create_table()
     print("Welcome to the Anime List Database")
     logged_in = False
     user_id = None
@@ -221,14 +389,17 @@ def main():
         print("17. View Preferences")
         print("18. Update Preferences")
         print("19. Manage Genres") # New option
-        print("20. Logout")
-        choice = get_user_input("Enter your choice: ", int, 1, 20)
+        print("20. Import from CSV")
+        print("21. Top Rated Anime")
+        print("22. Faceted Search")
+        print("23. Recommendations")
+        print("24. Logout")
+        choice = get_user_input("Enter your choice: ", int, 1, 24)
 
         if choice == 1:
             add_anime()
         elif choice == 2:
-            anime_list = database.get_all_anime()
-            print_anime_list(anime_list)
+            browse_anime()
         elif choice == 3:
             update_anime()
         elif choice == 4:
@@ -254,13 +425,10 @@ def main():
         elif choice == 14:
             view_user_reviews(user_id)
         elif choice == 15:
-            filename = input("Enter filename for export (default: anime_list.csv): ")
-            if not filename:
-                filename = 'anime_list.csv'
-            database.export_to_csv(filename)
-            print(f"Anime list exported to {filename}.")
+            export_data()
         elif choice == 16:
-            database.backup_database()
+            compress = input("Compress the backup? (y/N): ").strip().lower() == 'y'
+            database.backup_database(compress=compress, progress=print_backup_progress)
         elif choice == 17:
             if user_id:
                 view_preferences(user_id)
@@ -282,8 +450,17 @@ def main():
             elif genre_choice == 4:
                 view_all_genres()
         elif choice == 20:
+            import_from_csv()
+        elif choice == 21:
+            view_top_rated()
+        elif choice == 22:
+            search_anime_faceted()
+        elif choice == 23:
+            view_recommendations(user_id)
+        elif choice == 24:
             print("Logged out successfully.")
             main()
 
 if __name__ == "__main__":
+    instrumentation.enable_from_environment()
     main()
@@ -0,0 +1,211 @@
+import argparse
+import heapq
+import math
+from datetime import datetime
+
+import database
+
+NEIGHBORS = 20
+# Similarities backed by few shared raters are scaled by n / (n + SHRINKAGE).
+SHRINKAGE = 10
+RECOMMENDATION_LIMIT = 10
+RATING_MIDPOINT = 5.5
+CHUNK_SIZE = 900
+
+def chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def item_stats(conn):
+    # Mean and centered norm per anime, straight from the rating summary
+    # histogram, so no pass over reviews is needed.
+    stats = {}
+    cursor = conn.execute(f'''
+        SELECT anime_id, review_count, rating_sum, {database.HISTOGRAM_COLUMNS}
+        FROM anime_rating_summary
+        WHERE review_count > 0
+    ''')
+    for row in cursor:
+        anime_id, count, total, histogram = row[0], row[1], row[2], row[3:]
+        squares = sum(rating * rating * n for rating, n in zip(database.RATINGS, histogram))
+        mean = total / count
+        stats[anime_id] = (mean, math.sqrt(max(squares - count * mean * mean, 0.0)))
+    return stats
+
+class RatingMatrix:
+    # Sparse user x anime ratings, loaded lazily by row and by column.
+    def __init__(self, conn):
+        self.conn = conn
+        self.raters = {}
+        self.user_ratings = {}
+
+    def load_all(self):
+        for user_id, anime_id, rating in self.conn.execute(
+                'SELECT user_id, anime_id, rating FROM reviews WHERE rating IS NOT NULL'):
+            self.raters.setdefault(anime_id, []).append((user_id, rating))
+            self.user_ratings.setdefault(user_id, []).append((anime_id, rating))
+
+    def load_anime(self, anime_ids):
+        missing = [anime_id for anime_id in anime_ids if anime_id not in self.raters]
+        for chunk in chunks(missing):
+            for anime_id in chunk:
+                self.raters[anime_id] = []
+            cursor = self.conn.execute('''
+                SELECT anime_id, user_id, rating FROM reviews
+                WHERE rating IS NOT NULL AND anime_id IN ({})
+            '''.format(','.join('?' * len(chunk))), chunk)
+            for anime_id, user_id, rating in cursor:
+                self.raters[anime_id].append((user_id, rating))
+        users = {user_id for anime_id in anime_ids for user_id, _ in self.raters[anime_id]}
+        missing = [user_id for user_id in users if user_id not in self.user_ratings]
+        for chunk in chunks(missing):
+            for user_id in chunk:
+                self.user_ratings[user_id] = []
+            cursor = self.conn.execute('''
+                SELECT user_id, anime_id, rating FROM reviews
+                WHERE rating IS NOT NULL AND user_id IN ({})
+            '''.format(','.join('?' * len(chunk))), chunk)
+            for user_id, anime_id, rating in cursor:
+                self.user_ratings[user_id].append((anime_id, rating))
+
+    def similarities(self, anime_id, stats):
+        # Item-centered cosine against every anime sharing at least one rater.
+        mean, norm = stats.get(anime_id, (0.0, 0.0))
+        if not norm:
+            return {}
+        dots = {}
+        shared = {}
+        for user_id, rating in self.raters.get(anime_id, ()):
+            centered = rating - mean
+            for other_id, other_rating in self.user_ratings[user_id]:
+                if other_id == anime_id or other_id not in stats:
+                    continue
+                dots[other_id] = dots.get(other_id, 0.0) + centered * (other_rating - stats[other_id][0])
+                shared[other_id] = shared.get(other_id, 0) + 1
+        scores = {}
+        for other_id, dot in dots.items():
+            other_norm = stats[other_id][1]
+            if other_norm and dot > 0:
+                n = shared[other_id]
+                scores[other_id] = dot / (norm * other_norm) * n / (n + SHRINKAGE)
+        return scores
+
+def top_neighbors(scores, k=NEIGHBORS):
+    return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+def save_neighbors(conn, neighbor_lists):
+    for anime_id, neighbors in neighbor_lists.items():
+        conn.execute('DELETE FROM anime_similarity WHERE anime_id = ?', (anime_id,))
+        conn.executemany('INSERT INTO anime_similarity (anime_id, neighbor_id, score) VALUES (?, ?, ?)',
+                         ((anime_id, neighbor_id, score) for neighbor_id, score in neighbors))
+
+def recompute_all(conn, stats):
+    # Read the queue before the ratings: a rating changed in between is then
+    # either in the matrix or still queued, never cleared without being seen.
+    dirty = conn.execute('SELECT anime_id, version FROM similarity_dirty').fetchall()
+    matrix = RatingMatrix(conn)
+    matrix.load_all()
+    neighbor_lists = {anime_id: top_neighbors(matrix.similarities(anime_id, stats)) for anime_id in matrix.raters}
+    return neighbor_lists, dirty, True
+
+def recompute_dirty(conn, stats):
+    dirty = conn.execute('SELECT anime_id, version FROM similarity_dirty').fetchall()
+    if not dirty:
+        return {}, dirty, False
+    dirty_ids = [anime_id for anime_id, _ in dirty]
+    matrix = RatingMatrix(conn)
+    matrix.load_anime(dirty_ids)
+    neighbor_lists = {}
+    # Anime that list a dirty anime as a neighbor must be recomputed in full,
+    # since its score may have dropped below their other candidates.
+    affected = set()
+    for chunk in chunks(dirty_ids):
+        cursor = conn.execute('SELECT anime_id FROM anime_similarity WHERE neighbor_id IN ({})'.format(
+            ','.join('?' * len(chunk))), chunk)
+        affected.update(anime_id for anime_id, in cursor)
+    candidates = {}
+    for anime_id in dirty_ids:
+        scores = matrix.similarities(anime_id, stats)
+        neighbor_lists[anime_id] = top_neighbors(scores)
+        for other_id, score in scores.items():
+            candidates[other_id] = max(score, candidates.get(other_id, 0.0))
+    # Anything else only needs a recompute if a dirty anime now beats its
+    # weakest stored neighbor.
+    unchecked = [anime_id for anime_id in candidates if anime_id not in affected and anime_id not in neighbor_lists]
+    for chunk in chunks(unchecked):
+        floors = dict((anime_id, (count, lowest)) for anime_id, count, lowest in conn.execute('''
+            SELECT anime_id, COUNT(*), MIN(score) FROM anime_similarity
+            WHERE anime_id IN ({}) GROUP BY anime_id
+        '''.format(','.join('?' * len(chunk))), chunk))
+        for anime_id in chunk:
+            count, lowest = floors.get(anime_id, (0, 0.0))
+            if count < NEIGHBORS or candidates[anime_id] > lowest:
+                affected.add(anime_id)
+    affected.difference_update(neighbor_lists)
+    matrix.load_anime(affected)
+    for anime_id in affected:
+        neighbor_lists[anime_id] = top_neighbors(matrix.similarities(anime_id, stats))
+    return neighbor_lists, dirty, False
+
+def recompute_similarities(full=False):
+    conn = database.create_connection()
+    computed_at = conn.execute('SELECT computed_at FROM similarity_state WHERE id = 1').fetchone()[0]
+    stats = item_stats(conn)
+    if full or computed_at is None:
+        neighbor_lists, dirty, replace = recompute_all(conn, stats)
+    else:
+        neighbor_lists, dirty, replace = recompute_dirty(conn, stats)
+    with conn:
+        if replace:
+            conn.execute('DELETE FROM anime_similarity')
+        save_neighbors(conn, neighbor_lists)
+        # Entries bumped again while we were computing stay queued.
+        conn.executemany('DELETE FROM similarity_dirty WHERE anime_id = ? AND version = ?', dirty)
+        conn.execute('UPDATE similarity_state SET computed_at = ? WHERE id = 1', (datetime.now().isoformat(),))
+    return len(neighbor_lists)
+
+def because_you_rated(anime_id, limit=RECOMMENDATION_LIMIT):
+    conn = database.create_connection()
+    cursor = conn.execute('''
+        SELECT anime.rowid, anime.title, anime_similarity.score
+        FROM anime_similarity
+        JOIN anime ON anime.rowid = anime_similarity.neighbor_id
+        WHERE anime_similarity.anime_id = ?
+        ORDER BY anime_similarity.score DESC
+        LIMIT ?
+    ''', (anime_id, limit))
+    return cursor.fetchall()
+
+def recommend_for_user(user_id, limit=RECOMMENDATION_LIMIT):
+    conn = database.create_connection()
+    # Weight each neighbor by how much the user liked the anime it came from,
+    # relative to the middle of the scale, and skip anime they already reviewed.
+    cursor = conn.execute('''
+        WITH rated AS (
+            SELECT anime_id, rating - ? AS liking
+            FROM reviews
+            WHERE user_id = ? AND rating IS NOT NULL
+        )
+        SELECT anime.rowid, anime.title, SUM(anime_similarity.score * rated.liking) AS relevance
+        FROM rated
+        JOIN anime_similarity ON anime_similarity.anime_id = rated.anime_id
+        JOIN anime ON anime.rowid = anime_similarity.neighbor_id
+        WHERE anime_similarity.neighbor_id NOT IN (SELECT anime_id FROM reviews WHERE user_id = ?)
+        GROUP BY anime_similarity.neighbor_id
+        HAVING relevance > 0
+        ORDER BY relevance DESC
+        LIMIT ?
+    ''', (RATING_MIDPOINT, user_id, user_id, limit))
+    return cursor.fetchall()
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute anime similarity neighbors')
+    parser.add_argument('--full', action='store_true', help='recompute every anime, not just changed ones')
+    args = parser.parse_args()
+    database.create_table()
+    count = recompute_similarities(args.full)
+    print(f"Recomputed neighbors for {count} anime.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import time
+from collections import namedtuple
+
+import cache
+import database
+
+# One anime as both front-ends see it: ratings are floats (or None) and
+# genres is a tuple of names.
+Anime = namedtuple('Anime', ['id', 'title', 'episodes', 'status', 'rating', 'genres'])
+
+FIELDS = ('title', 'episodes', 'status', 'rating')
+
+# Genres are read per row through the anime_genre primary key.
+ANIME_SELECT = '''
+    SELECT anime.id, anime.title, anime.episodes, anime.status, anime.rating,
+           (SELECT group_concat(genre.name, ',')
+            FROM anime_genre JOIN genre ON genre.id = anime_genre.genre_id
+            WHERE anime_genre.anime_id = anime.id) AS genres
+    FROM anime
+'''
+
+def to_anime(row):
+    anime_id, title, episodes, status, rating, genres = row
+    return Anime(anime_id, title, episodes, status, rating, tuple(database.split_genres(genres)))
+
+def get_anime(anime_id, conn=None):
+    conn = conn or database.create_connection()
+    row = conn.execute(f'{ANIME_SELECT} WHERE anime.id = ?', (anime_id,)).fetchone()
+    return to_anime(row) if row else None
+
+def list_anime(genre=None, status=None, min_rating=None, max_rating=None, limit=None):
+    # Every filter here is an index seek: genre through idx_genre_name and
+    # idx_anime_genre_genre_id, status through idx_anime_status and the
+    # rating range through idx_anime_rating.
+    clauses = []
+    params = []
+    if genre:
+        clauses.append('''anime.id IN (
+            SELECT anime_genre.anime_id FROM genre
+            JOIN anime_genre ON anime_genre.genre_id = genre.id
+            WHERE genre.name = ? COLLATE NOCASE)''')
+        params.append(genre)
+    if status:
+        clauses.append('anime.status = ?')
+        params.append(status)
+    if min_rating is not None or max_rating is not None:
+        clauses.append('anime.rating BETWEEN ? AND ?')
+        params.extend((min_rating if min_rating is not None else 0, max_rating if max_rating is not None else 10))
+    sql = ANIME_SELECT + (' WHERE ' + ' AND '.join(clauses) if clauses else '') + ' ORDER BY anime.id'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    conn = database.create_connection()
+    return [to_anime(row) for row in conn.execute(sql, params)]
+
+def set_genres(conn, anime_id, names):
+    conn.execute('DELETE FROM anime_genre WHERE anime_id = ?', (anime_id,))
+    conn.executemany('INSERT OR IGNORE INTO anime_genre (anime_id, genre_id) VALUES (?, ?)',
+                     ((anime_id, genre_id) for genre_id in database.genre_ids(conn, names)))
+
+def add_anime(title, episodes=None, status=None, rating=None, genres=()):
+    conn = database.create_connection()
+    with conn:
+        cursor = conn.execute('INSERT INTO anime (title, episodes, status, rating) VALUES (?, ?, ?, ?)',
+                              (title, episodes, status, rating))
+        anime_id = cursor.lastrowid
+        database.index_titles(conn, [(anime_id, title)])
+        if genres:
+            set_genres(conn, anime_id, genres)
+    return anime_id
+
+def update_anime(anime_id, **changes):
+    # Accepts any of FIELDS plus genres; returns the anime as it was before,
+    # or None without writing anything if there is no such anime.
+    genres = changes.pop('genres', None)
+    unknown = set(changes) - set(FIELDS)
+    if unknown:
+        raise ValueError(f'Cannot update anime field(s): {", ".join(sorted(unknown))}')
+    conn = database.create_connection()
+    with conn:
+        old = get_anime(anime_id, conn)
+        if old is None:
+            return None
+        if changes:
+            assignments = ', '.join(f'{field} = ?' for field in changes)
+            conn.execute(f'UPDATE anime SET {assignments} WHERE id = ?', (*changes.values(), anime_id))
+        if 'title' in changes:
+            database.unindex_title(conn, anime_id)
+            database.index_titles(conn, [(anime_id, changes['title'])])
+        if genres is not None:
+            set_genres(conn, anime_id, genres)
+    cache.invalidate('get_anime_by_id', anime_id)
+    return old
+
+def delete_anime(anime_id):
+    # Returns the deleted anime, or None if there was none.
+    conn = database.create_connection()
+    with conn:
+        old = get_anime(anime_id, conn)
+        conn.execute('DELETE FROM anime_genre WHERE anime_id = ?', (anime_id,))
+        conn.execute('DELETE FROM anime WHERE id = ?', (anime_id,))
+        database.unindex_title(conn, anime_id)
+    cache.invalidate('get_anime_by_id', anime_id)
+    return old
+
+def import_anime(records, batch_size=database.BULK_BATCH_SIZE, fast=False, truncate=False):
+    # records yields (title, episodes, status, rating, genres). Ids are
+    # handed out inside the load transaction so genre links can be written
+    # alongside each batch.
+    started = time.perf_counter()
+    count = 0
+    with database.bulk_load('anime', batch_size, fast, truncate) as conn:
+        if truncate:
+            conn.execute('DELETE FROM anime_genre')
+        next_id = conn.execute('''
+            SELECT MAX(IFNULL((SELECT MAX(id) FROM anime), 0),
+                       IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'anime'), 0))
+        ''').fetchone()[0] + 1
+        known = {}
+        for batch in database.batched(records, batch_size):
+            rows = []
+            links = []
+            for title, episodes, status, rating, genres in batch:
+                rows.append((next_id, title, episodes, status, rating))
+                links.extend((next_id, genre_id) for genre_id in database.genre_ids(conn, genres, known))
+                next_id += 1
+            conn.executemany('INSERT INTO anime (id, title, episodes, status, rating) VALUES (?, ?, ?, ?, ?)', rows)
+            conn.executemany('INSERT OR IGNORE INTO anime_genre (anime_id, genre_id) VALUES (?, ?)', links)
+            count += len(rows)
+    seconds = time.perf_counter() - started
+    return database.LoadStats(count, seconds, count / seconds if seconds else 0.0)
@@ -0,0 +1,187 @@
+import argparse
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import database
+
+# Reporting queries run against a private in-memory copy of the database
+# instead of anime_list.db. The copy is taken with the backup API in a single
+# step, which under WAL only holds a read transaction on the file: writers
+# carry on while it runs and never wait on the reports afterwards. The whole
+# database is held in memory, so check info().bytes on large catalogs.
+REFRESH_INTERVAL = 300
+TOP_REVIEWERS_LIMIT = 20
+
+SnapshotInfo = namedtuple('SnapshotInfo', ['taken_at', 'age', 'bytes', 'copy_seconds', 'refreshes', 'error'])
+
+class Snapshot:
+    def __init__(self, path=None):
+        # path=None follows database.DB_PATH at every refresh.
+        self.path = path
+        self.conn = None
+        self.taken_at = None
+        self.taken = None
+        self.copy_seconds = 0.0
+        self.refreshes = 0
+        self.error = None
+        # lock guards the connection swap and the queries on it; the copy
+        # itself runs under refresh_lock so reports keep using the old copy.
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def refresh(self):
+        with self.refresh_lock:
+            started = time.perf_counter()
+            source = database.open_connection(self.path)
+            target = sqlite3.connect(':memory:', check_same_thread=False)
+            try:
+                source.backup(target)
+            except BaseException:
+                target.close()
+                raise
+            finally:
+                source.close()
+            target.execute('PRAGMA query_only = ON')
+            with self.lock:
+                old, self.conn = self.conn, target
+                self.taken_at = datetime.now()
+                self.taken = time.monotonic()
+                self.copy_seconds = time.perf_counter() - started
+                self.refreshes += 1
+                self.error = None
+            if old is not None:
+                old.close()
+
+    def age(self):
+        return time.monotonic() - self.taken if self.taken is not None else None
+
+    def ensure(self, max_age=None):
+        age = self.age()
+        if age is None or (max_age is not None and age > max_age):
+            self.refresh()
+
+    def query(self, sql, params=(), max_age=None):
+        # Read-only: query_only makes any write fail with sqlite3.OperationalError.
+        self.ensure(max_age)
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def size(self):
+        with self.lock:
+            if self.conn is None:
+                return 0
+            page_count = self.conn.execute('PRAGMA page_count').fetchone()[0]
+            page_size = self.conn.execute('PRAGMA page_size').fetchone()[0]
+            return page_count * page_size
+
+    def info(self):
+        return SnapshotInfo(self.taken_at.isoformat() if self.taken_at else None, self.age(), self.size(),
+                            self.copy_seconds, self.refreshes, self.error)
+
+    def start(self, interval=REFRESH_INTERVAL):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, args=(interval,), name='anime-db-snapshot', daemon=True)
+            self.thread.start()
+
+    def run(self, interval):
+        while not self.stopping.wait(interval):
+            try:
+                self.refresh()
+            except sqlite3.Error as e:
+                # Keep serving the previous copy; info() reports the failure.
+                self.error = str(e)
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.stopping.set()
+            thread.join()
+
+    def close(self):
+        self.stop()
+        with self.lock:
+            conn, self.conn = self.conn, None
+            self.taken = self.taken_at = None
+        if conn is not None:
+            conn.close()
+
+_snapshot = Snapshot()
+
+def get_snapshot():
+    return _snapshot
+
+def refresh():
+    _snapshot.refresh()
+    return _snapshot.info()
+
+def query(sql, params=(), max_age=None):
+    return _snapshot.query(sql, params, max_age)
+
+def info():
+    return _snapshot.info()
+
+def start(interval=REFRESH_INTERVAL):
+    _snapshot.start(interval)
+
+def stop():
+    _snapshot.close()
+
+def genre_ratings(max_age=None):
+    # (genre, anime, reviews, average review rating) for every genre.
+    return query('''
+        SELECT genre.name, COUNT(DISTINCT anime_genre.anime_id), COUNT(reviews.rating), AVG(reviews.rating)
+        FROM genre
+        JOIN anime_genre ON anime_genre.genre_id = genre.id
+        LEFT JOIN reviews ON reviews.anime_id = anime_genre.anime_id
+        GROUP BY genre.id
+        ORDER BY COUNT(reviews.rating) DESC
+    ''', max_age=max_age)
+
+def top_reviewers(limit=TOP_REVIEWERS_LIMIT, max_age=None):
+    # (username, reviews, average rating, genres covered) for the most active users.
+    return query('''
+        SELECT users.username, COUNT(*), AVG(reviews.rating),
+               (SELECT COUNT(DISTINCT anime_genre.genre_id)
+                FROM reviews AS covered
+                JOIN anime_genre ON anime_genre.anime_id = covered.anime_id
+                WHERE covered.user_id = users.id)
+        FROM reviews
+        JOIN users ON users.id = reviews.user_id
+        GROUP BY users.id
+        ORDER BY COUNT(*) DESC
+        LIMIT ?
+    ''', (limit,), max_age)
+
+def format_average(value):
+    return f"{value:.2f}" if value is not None else '-'
+
+def main():
+    parser = argparse.ArgumentParser(description='Catalog reports from an in-memory snapshot of the database')
+    parser.add_argument('report', choices=['genres', 'reviewers', 'info'])
+    parser.add_argument('--limit', type=int, default=TOP_REVIEWERS_LIMIT)
+    args = parser.parse_args()
+    database.create_table()
+    snapshot = refresh()
+    print(f"Snapshot of {snapshot.bytes / 1048576:.1f} MiB taken in {snapshot.copy_seconds:.2f}s.")
+    if args.report == 'genres':
+        print(f"{'Genre':<20} {'Anime':<8} {'Reviews':<10} {'Average':<8}")
+        print("="*50)
+        for name, anime, reviews, average in genre_ratings():
+            print(f"{name:<20} {anime:<8} {reviews:<10} {format_average(average):<8}")
+    elif args.report == 'reviewers':
+        print(f"{'Username':<20} {'Reviews':<8} {'Average':<8} {'Genres':<6}")
+        print("="*46)
+        for username, reviews, average, genres in top_reviewers(args.limit):
+            print(f"{username:<20} {reviews:<8} {format_average(average):<8} {genres:<6}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+import database
+import repository
+
+def test_export_import_round_trip(tmp_path):
+    original = database.DB_PATH
+    try:
+        database.configure(path=str(tmp_path / 'source.db'))
+        repository.add_anime('Frieren', 28, 'Completed', 9.3)
+        repository.add_anime('Untitled Project')
+        database.export_to_csv(str(tmp_path / 'anime.csv'))
+        database.configure(path=str(tmp_path / 'target.db'))
+        stats = database.import_from_csv(str(tmp_path / 'anime.csv'))
+        conn = database.create_connection()
+        rows = conn.execute('SELECT title, episodes, status, rating FROM anime ORDER BY id').fetchall()
+    finally:
+        database.configure(path=original)
+    assert stats.rows == 2
+    assert rows == [('Frieren', 28, 'Completed', 9.3), ('Untitled Project', None, None, None)]
@@ -0,0 +1,54 @@
+import database
+import repository
+
+def summaries(conn):
+    catalog = conn.execute('SELECT anime_count, rated_count, rating_sum FROM catalog_summary WHERE id = 1').fetchone()
+    per_anime = conn.execute('''
+        SELECT anime_id, review_count, rating_sum, CAST(rating_sum AS REAL) / review_count
+        FROM anime_rating_summary
+        WHERE review_count > 0
+        ORDER BY anime_id
+    ''').fetchall()
+    return catalog, per_anime
+
+def recounted(conn):
+    catalog = conn.execute('SELECT COUNT(*), COUNT(rating), IFNULL(SUM(rating), 0) FROM anime').fetchone()
+    per_anime = conn.execute('''
+        SELECT anime_id, COUNT(rating), SUM(rating), AVG(rating)
+        FROM reviews
+        WHERE rating IS NOT NULL
+        GROUP BY anime_id
+        ORDER BY anime_id
+    ''').fetchall()
+    return catalog, per_anime
+
+def test_summaries_follow_inserts_updates_and_deletes(tmp_path):
+    original = database.DB_PATH
+    try:
+        database.configure(path=str(tmp_path / 'summaries.db'))
+        conn = database.create_connection()
+        anime_ids = [repository.add_anime(f'Anime {number}', rating=number % 4 * 2.5 or None)
+                     for number in range(12)]
+        reviews = [database.add_review(user_id, anime_id, (user_id + anime_id) % 10 + 1, 'ok')
+                   for anime_id in anime_ids for user_id in range(1, 4)]
+        database.add_review(4, anime_ids[0], None, 'no rating')
+        assert summaries(conn) == recounted(conn)
+
+        for anime_id in anime_ids[::3]:
+            repository.update_anime(anime_id, rating=7.5)
+        repository.update_anime(anime_ids[1], rating=None)
+        for review_id in reviews[::4]:
+            database.update_review(review_id, 10, 'better')
+        database.update_review(reviews[1], None, 'unrated now')
+        assert summaries(conn) == recounted(conn)
+
+        for review_id in reviews[2::5]:
+            database.delete_review(review_id)
+        for anime_id in anime_ids[::4]:
+            conn.execute('DELETE FROM reviews WHERE anime_id = ?', (anime_id,))
+            conn.commit()
+            repository.delete_anime(anime_id)
+        database.delete_anime(anime_ids[5])
+        assert summaries(conn) == recounted(conn)
+    finally:
+        database.configure(path=original)
@@ -0,0 +1,206 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+import cache
+import database
+
+# Opt-in group commit for small, frequent writes. Callers get a
+# concurrent.futures.Future (asyncio code can await asyncio.wrap_future on
+# it); one writer thread commits whatever has queued up in a single
+# transaction and resolves each future only once that commit is durable.
+MAX_BATCH = 256
+# How long the writer waits for more writes after the first one arrives.
+MAX_DELAY = 0.005
+
+Request = namedtuple('Request', ['name', 'args', 'future'])
+
+# name -> op(conn, *args) returning (result, caches to invalidate). Each
+# runs inside the group's transaction and must not commit.
+def add_review(conn, user_id, anime_id, rating, review):
+    return database.insert_review(conn, user_id, anime_id, rating, review), [('get_reviews_for_anime', anime_id)]
+
+def update_review(conn, review_id, rating, review):
+    anime_id = database.review_anime_id(conn, review_id)
+    return database.change_review(conn, review_id, rating, review), [('get_reviews_for_anime', anime_id)]
+
+def upsert_review(conn, user_id, anime_id, rating, review):
+    return database.save_review(conn, user_id, anime_id, rating, review), [('get_reviews_for_anime', anime_id)]
+
+def add_preference(conn, user_id, key, value):
+    return database.insert_preference(conn, user_id, key, value), [('get_preferences', user_id)]
+
+def update_preference(conn, user_id, key, value):
+    return database.change_preference(conn, user_id, key, value), [('get_preferences', user_id)]
+
+def set_preferences(conn, user_id, preferences):
+    return database.save_preferences(conn, user_id, preferences), [('get_preferences', user_id)]
+
+OPERATIONS = {
+    'add_review': add_review,
+    'update_review': update_review,
+    'upsert_review': upsert_review,
+    'add_preference': add_preference,
+    'update_preference': update_preference,
+    'set_preferences': set_preferences,
+}
+
+def invalidate(touched):
+    for name, key in touched:
+        cache.invalidate(name, key)
+
+class WriteQueue:
+    def __init__(self, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.closed = False
+        self.groups = 0
+        self.writes = 0
+        self.fallbacks = 0
+
+    def start(self):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('write queue is closed')
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='anime-db-group-commit', daemon=True)
+                self.thread.start()
+        return self
+
+    def submit(self, name, *args):
+        if name not in OPERATIONS:
+            raise ValueError(f'Unknown queued write: {name}')
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('write queue is closed')
+            self.requests.put(Request(name, args, future))
+        return future
+
+    def close(self, wait=True):
+        # Writes already queued are still committed.
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.requests.put(None)
+            thread = self.thread
+        if wait and thread is not None:
+            thread.join()
+
+    def run(self):
+        try:
+            while True:
+                first = self.requests.get()
+                if first is None:
+                    return
+                batch = [first]
+                deadline = time.monotonic() + self.max_delay
+                stop = False
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is None:
+                        stop = True
+                        break
+                    batch.append(request)
+                self.commit(batch)
+                if stop:
+                    return
+        finally:
+            database.close_connection()
+
+    def commit(self, batch):
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        conn = database.create_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            outcomes = [self.apply(conn, request) for request in batch]
+            conn.commit()
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            # The group could not commit (busy, disk full, ...): retry each
+            # write in its own transaction so every caller gets the outcome
+            # it would have had without batching.
+            self.fallbacks += 1
+            for request in batch:
+                self.commit_one(conn, request)
+            return
+        self.groups += 1
+        self.writes += len(batch)
+        for request, (error, result, touched) in zip(batch, outcomes):
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                invalidate(touched)
+                request.future.set_result(result)
+
+    def apply(self, conn, request):
+        # A savepoint per write, so one failing write (a constraint, say)
+        # is undone alone and the rest of the group still commits.
+        conn.execute('SAVEPOINT queued_write')
+        try:
+            result, touched = OPERATIONS[request.name](conn, *request.args)
+        except Exception as e:
+            conn.execute('ROLLBACK TO queued_write')
+            conn.execute('RELEASE queued_write')
+            return e, None, ()
+        conn.execute('RELEASE queued_write')
+        return None, result, touched
+
+    def commit_one(self, conn, request):
+        try:
+            with conn:
+                result, touched = OPERATIONS[request.name](conn, *request.args)
+        except Exception as e:
+            request.future.set_exception(e)
+            return
+        self.groups += 1
+        self.writes += 1
+        invalidate(touched)
+        request.future.set_result(result)
+
+    def stats(self):
+        return {
+            'groups': self.groups,
+            'writes': self.writes,
+            'fallbacks': self.fallbacks,
+            'pending': self.requests.qsize(),
+        }
+
+_lock = threading.Lock()
+_queue = None
+
+def start(max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+    global _queue
+    with _lock:
+        if _queue is None:
+            _queue = WriteQueue(max_batch, max_delay).start()
+        return _queue
+
+def shutdown():
+    global _queue
+    with _lock:
+        current, _queue = _queue, None
+    if current is not None:
+        current.close()
+
+def submit(name, *args):
+    # e.g. submit('add_review', user_id, anime_id, rating, review).result()
+    # is the new review's id once it has been committed.
+    return start().submit(name, *args)
+
+atexit.register(shutdown)